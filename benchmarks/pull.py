@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Pull benchmark for VodBot, timing the hot paths of a pull against a local Twitch stand-in: listing
+# channel VODs, fetching chat, downloading VOD segments, and writing chat as YouTube captions.
+# Nothing is sent to Twitch, and nothing outside of a throwaway directory is touched.
+#
+# Usage: python benchmarks/pull.py [--latency S] [--bandwidth B] [--failure-rate P] [--workers N] ...
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+from twitch_server import StandInServer
+
+from vodbot import chatlog, twitch
+from vodbot.config import Config
+from vodbot.itd import download, gql, worker
+
+
+def _time(fn, repeat: int):
+	times = []
+	result = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = fn()
+		times.append(time.perf_counter() - start)
+	return statistics.median(times), result
+
+
+def _report(name: str, secs: float, amount: float, unit: str):
+	print(f"{name:<22} {secs * 1000:9.1f} ms  {amount / secs:12.1f} {unit}/s")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Measures VodBot pull throughput against a local Twitch stand-in.")
+	parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the median is reported")
+	parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+	parser.add_argument("--bandwidth", type=int, default=0, help="bytes per second per segment connection, 0 for no limit")
+	parser.add_argument("--failure-rate", type=float, default=0.0, help="chance of a segment connection being cut")
+	parser.add_argument("--vods", type=int, default=300, help="VODs listed for the channel")
+	parser.add_argument("--comments", type=int, default=5000, help="chat messages per VOD")
+	parser.add_argument("--segments", type=int, default=200, help="segments per VOD")
+	parser.add_argument("--segment-size", type=int, default=188 * 1000, help="bytes per segment")
+	parser.add_argument("--workers", type=int, default=None, help="download workers, defaults to the config default")
+	parser.add_argument("--chunk-size", type=int, default=None, help="download chunk size, defaults to the config default")
+	args = parser.parse_args()
+
+	conf = Config()
+	if args.workers:
+		conf.pull.max_workers = args.workers
+	if args.chunk_size:
+		conf.pull.chunk_size = args.chunk_size
+	conf.pull.connection_retries = max(conf.pull.connection_retries, 10)
+
+	server = StandInServer(vods_per_channel=args.vods, comments_per_vod=args.comments,
+		segments_per_vod=args.segments, segment_size=args.segment_size,
+		latency=args.latency, bandwidth=args.bandwidth, failure_rate=args.failure_rate)
+
+	with server, tempfile.TemporaryDirectory() as tmp:
+		gql.GQL_URL = f"{server.url}/gql"
+		download.USHER_URL = server.url + "/vod/{video_id}"
+		channel = twitch.Channel(id="1", login="benchmark", display_name="benchmark", created_at="")
+		video_id = "1000000000"
+
+		secs, vods = _time(lambda: twitch.get_channel_vods(channel), args.repeat)
+		_report("get_channel_vods", secs, len(vods), "vods")
+
+		secs, msgs = _time(lambda: twitch.get_video_comments(video_id), args.repeat)
+		_report("get_video_comments", secs, len(msgs), "msgs")
+
+		# the same steps dl_video takes before joining with FFmpeg
+		token = gql.get_access_token(video_id)
+		source_uri = download.get_playlist_uris(video_id, token)[0]
+		base_uri = "/".join(source_uri.split("/")[:-1]) + "/"
+		vod_paths = [f"{i}.ts" for i in range(args.segments)]
+
+		def pull_segments():
+			target = Path(tempfile.mkdtemp(dir=tmp))
+			worker.download_files(conf, video_id, base_uri, target, vod_paths)
+			return target
+		secs, _ = _time(pull_segments, args.repeat)
+		total = args.segments * server.segment_size
+		_report("worker.download_files", secs, total / 1e6, "MB")
+
+		ytt_path = Path(tmp) / "chat.ytt"
+		secs, _ = _time(lambda: chatlog.chat_to_ytt(conf, msgs, str(ytt_path), 10 * args.segments), args.repeat)
+		_report("chatlog.chat_to_ytt", secs, len(msgs), "msgs")
+
+	print()
+	print("stand-in requests:")
+	for kind, n in sorted(server.requests.items()):
+		print(f"  {kind:<22} {n}")
+
+
+if __name__ == "__main__":
+	main()
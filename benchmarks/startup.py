@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# Startup benchmark for VodBot, tracking how long shell completion and light commands take.
+# Runs against a throwaway config, cache, and stage directory, so nothing real is touched.
+#
+# Usage: python benchmarks/startup.py [--repeat N] [--top N]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def _make_sandbox(root: Path) -> Path:
+	dirs = {name: root / name for name in ["vods", "clips", "temp", "stage", "thumbnail"]}
+	for d in dirs.values():
+		d.mkdir(parents=True, exist_ok=True)
+
+	channels = [f"channel_{x:02d}" for x in range(10)]
+	config_path = root / "config.json"
+	with open(config_path, "w") as f:
+		json.dump({
+			"channels": [{"username": c} for c in channels],
+			"directories": {k: str(v) for k, v in dirs.items()},
+		}, f)
+
+	cache = {"channels": {}, "stages": []}
+	for c in channels:
+		cache["channels"][c] = {
+			"vods": {str(1000000000 + x): f"2023-01-01T00;00;00Z_{1000000000 + x}.meta" for x in range(200)},
+			"clips": {str(2000000000 + x): f"2023-01-01T00;00;00Z_{2000000000 + x}.meta" for x in range(500)},
+			"slugs": {},
+		}
+	for x in range(50):
+		sid = f"s{x:03d}"
+		cache["stages"].append(sid)
+		with open(dirs["stage"] / f"{sid}.stage", "w") as f:
+			json.dump({
+				"id": sid, "title": f"Stage {x}", "desc": "desc", "streamers": ["channel_00"],
+				"datestring": "2023/01/01", "thumbnail": None,
+				"slices": [{"video_id": "1000000000", "ss": "0:0:0", "to": "EOF", "filepath": "none.mkv"}],
+			}, f)
+	with open(dirs["temp"] / "cache.json", "w") as f:
+		json.dump(cache, f)
+
+	return config_path
+
+
+def _time_runs(cmd, env, repeat: int) -> float:
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		subprocess.run(cmd, env=env, cwd=REPO_DIR,
+			stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+		times.append(time.perf_counter() - start)
+	return statistics.median(times) * 1000
+
+
+def _completion_env(config_path: Path, comp_line: str) -> dict:
+	env = dict(os.environ)
+	env.update({
+		"_ARGCOMPLETE": "1",
+		"_ARGCOMPLETE_SHELL": "bash",
+		"_ARGCOMPLETE_IFS": "\013",
+		"_ARGCOMPLETE_STDOUT_FILENAME": os.devnull,
+		"COMP_LINE": comp_line,
+		"COMP_POINT": str(len(comp_line)),
+		"COMP_TYPE": "9",
+		"PYTHONPATH": str(REPO_DIR),
+	})
+	return env
+
+
+def import_times(top: int):
+	# `-X importtime` writes "self | cumulative | module" lines to stderr, in microseconds
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import vodbot.__main__"],
+		cwd=REPO_DIR, capture_output=True, text=True)
+
+	rows = []
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		selftime, cumulative, module = line[len("import time:"):].split("|")
+		rows.append((int(cumulative), int(selftime), module.rstrip()))
+
+	total = next((c for c, _, m in rows if m.strip() == "vodbot.__main__"), 0)
+	return total, sorted(rows, reverse=True)[:top]
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Measures VodBot startup and shell completion latency.")
+	parser.add_argument("--repeat", type=int, default=10, help="runs per measurement, the median is reported")
+	parser.add_argument("--top", type=int, default=15, help="number of slowest imports to list")
+	args = parser.parse_args()
+
+	total, rows = import_times(args.top)
+	print(f"import vodbot.__main__: {total / 1000:.1f} ms cumulative")
+	for cumulative, selftime, module in rows:
+		print(f"  {cumulative / 1000:8.1f} ms  (self {selftime / 1000:6.1f} ms) {module}")
+	print()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		config_path = _make_sandbox(Path(tmp))
+		base = [sys.executable, "-m", "vodbot", "-c", str(config_path)]
+		cases = {
+			"complete `stage rm`": f"vodbot -c {config_path} stage rm s0",
+			"complete `stage new`": f"vodbot -c {config_path} stage new 10000",
+			"complete `upload`": f"vodbot -c {config_path} upload ",
+		}
+		for name, comp_line in cases.items():
+			ms = _time_runs(base, _completion_env(config_path, comp_line), args.repeat)
+			print(f"{name:<24} {ms:8.1f} ms")
+
+		env = dict(os.environ, PYTHONPATH=str(REPO_DIR))
+		ms = _time_runs(base + ["stage", "list"], env, args.repeat)
+		print(f"{'`stage list`':<24} {ms:8.1f} ms")
+
+		ms = _time_runs([sys.executable, "-c", "pass"], env, args.repeat)
+		print(f"{'interpreter baseline':<24} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+	main()
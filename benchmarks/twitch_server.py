@@ -0,0 +1,251 @@
+# Local stand-in for the parts of Twitch that VodBot talks to while pulling: the GQL endpoint, the
+# usher playlist endpoint, and the segment CDN. Everything it serves is generated, so benchmarks can
+# run offline with whatever latency, bandwidth, and failure rate they need.
+# Only the standard library is used.
+
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Size of an MPEG-TS packet, segments are made of these with the 0x47 sync byte at the start of each
+TS_PACKET_SIZE = 188
+
+_LOGIN = re.compile(r'user\(login: "([^"]*)"\)')
+_VIDEO_ID = re.compile(r'(?:video|videoPlaybackAccessToken)\(id: "([^"]*)"')
+_AFTER = re.compile(r'after: (null|"[^"]*")')
+
+
+class StandInServer:
+	"""
+	Serves generated channels, VODs, comments, playlists, and segments on localhost.
+
+	:param latency: seconds added before every response.
+	:param bandwidth: bytes per second each segment is sent at, 0 for no limit.
+	:param failure_rate: chance of a segment connection being cut partway through its body.
+	"""
+
+	def __init__(self, vods_per_channel: int=300, clips_per_channel: int=300, comments_per_vod: int=5000,
+		segments_per_vod: int=200, segment_size: int=TS_PACKET_SIZE * 1000,
+		latency: float=0.0, bandwidth: int=0, failure_rate: float=0.0, seed: int=0):
+		self.vods_per_channel = vods_per_channel
+		self.clips_per_channel = clips_per_channel
+		self.comments_per_vod = comments_per_vod
+		self.segments_per_vod = segments_per_vod
+		self.segment_size = segment_size - segment_size % TS_PACKET_SIZE
+		self.latency = latency
+		self.bandwidth = bandwidth
+		self.failure_rate = failure_rate
+
+		self._random = random.Random(seed)
+		self._random_lock = threading.Lock()
+		self._segment = self._make_segment()
+
+		self.requests = {}
+		self._requests_lock = threading.Lock()
+
+		self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+		self._httpd.daemon_threads = True
+		self._thread = None
+
+	@property
+	def url(self) -> str:
+		host, port = self._httpd.server_address
+		return f"http://{host}:{port}"
+
+	def start(self) -> "StandInServer":
+		self._thread = threading.Thread(target=self._httpd.serve_forever, name="twitch-standin", daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._httpd.shutdown()
+		self._httpd.server_close()
+		self._thread.join()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def count(self, kind: str):
+		with self._requests_lock:
+			self.requests[kind] = self.requests.get(kind, 0) + 1
+
+	def should_fail(self) -> bool:
+		with self._random_lock:
+			return self._random.random() < self.failure_rate
+
+	def _make_segment(self) -> bytes:
+		packet = bytes([0x47]) + bytes(range(1, TS_PACKET_SIZE))
+		return packet * (self.segment_size // TS_PACKET_SIZE)
+
+	# GQL responses
+	def gql(self, query: str) -> dict:
+		after = _AFTER.search(query)
+		page = 0
+		if after and after.group(1) != "null":
+			page = int(after.group(1).strip('"'))
+
+		if "videoPlaybackAccessToken" in query:
+			self.count("gql:video_access")
+			return {"data": {"videoPlaybackAccessToken": {"signature": "0" * 40, "value": "{}"}}}
+		if "moments(" in query:
+			self.count("gql:video_chapters")
+			return {"data": {"video": {"moments": {"edges": [{"cursor": "", "node": {
+				"description": "Just Chatting", "type": "GAME_CHANGE",
+				"positionMilliseconds": 0, "durationMilliseconds": 3600000,
+			}}]}}}}
+		if "comments(" in query:
+			self.count("gql:video_comments")
+			return self._comments(_VIDEO_ID.search(query).group(1), page)
+		if "videos(" in query:
+			self.count("gql:channel_videos")
+			return self._videos(_LOGIN.search(query).group(1), page)
+		if "clips(" in query:
+			self.count("gql:channel_clips")
+			return self._clips(_LOGIN.search(query).group(1), page)
+		if "user(login" in query:
+			self.count("gql:channel")
+			login = _LOGIN.search(query).group(1)
+			return {"data": {"user": {"id": str(abs(hash(login)) % 10**8), "login": login,
+				"displayName": login, "createdAt": "2015-01-01T00:00:00Z"}}}
+
+		self.count("gql:unknown")
+		return {"errors": [{"message": "stand-in does not know this query"}]}
+
+	def _page(self, total: int, page: int, make) -> dict:
+		start = page * 100
+		end = min(start + 100, total)
+		edges = [{"cursor": str(page + 1) if end < total else "", "node": make(i)} for i in range(start, end)]
+		return edges
+
+	def _videos(self, login: str, page: int) -> dict:
+		creator = {"id": "1", "login": login, "displayName": login}
+		edges = self._page(self.vods_per_channel, page, lambda i: {
+			"id": str(1000000000 + i), "title": f"Stream {i}", "publishedAt": "2023-01-01T00:00:00Z",
+			"broadcastType": "ARCHIVE", "status": "RECORDED", "lengthSeconds": 10 * self.segments_per_vod,
+			"game": {"id": "509658", "name": "Just Chatting"}, "creator": creator,
+		})
+		return {"data": {"user": {"videos": {"totalCount": self.vods_per_channel, "edges": edges}}}}
+
+	def _clips(self, login: str, page: int) -> dict:
+		user = {"id": "1", "login": login, "displayName": login}
+		edges = self._page(self.clips_per_channel, page, lambda i: {
+			"id": str(2000000000 + i), "slug": f"Clip{i}", "title": f"Clip {i}",
+			"createdAt": "2023-01-01T00:00:00Z", "viewCount": i, "durationSeconds": 30,
+			"videoOffsetSeconds": 60, "video": {"id": "1000000000"},
+			"game": {"id": "509658", "name": "Just Chatting"}, "broadcaster": user, "curator": user,
+		})
+		return {"data": {"user": {"clips": {"pageInfo": {"hasNextPage": bool(edges and edges[-1]["cursor"])},
+			"edges": edges}}}}
+
+	def _comments(self, video_id: str, page: int) -> dict:
+		edges = self._page(self.comments_per_vod, page, lambda i: {
+			"contentOffsetSeconds": i * 10 * self.segments_per_vod // max(self.comments_per_vod, 1),
+			"commenter": {"displayName": f"chatter_{i % 97}"},
+			"message": {"userColor": None if i % 3 else "#1E90FF", "fragments": [
+				{"mention": None, "text": f"message number {i} "},
+				{"mention": {"displayName": f"chatter_{(i + 1) % 97}"}, "text": " hello"},
+			]},
+		})
+		return {"data": {"video": {"comments": {"edges": edges}}}}
+
+	# usher and CDN responses
+	def master_playlist(self, video_id: str) -> str:
+		self.count("usher")
+		lines = ["#EXTM3U"]
+		for name, height, bandwidth in [("chunked", 1080, 6000000), ("720p60", 720, 3000000)]:
+			lines.append(f'#EXT-X-MEDIA:TYPE=VIDEO,GROUP-ID="{name}",NAME="{height}p",AUTOSELECT=YES,DEFAULT=YES')
+			lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={height * 16 // 9}x{height},'
+				f'CODECS="avc1.64002A,mp4a.40.2",VIDEO="{name}"')
+			lines.append(f"{self.url}/cdn/{video_id}/{name}/index-dvr.m3u8")
+		return "\n".join(lines) + "\n"
+
+	def media_playlist(self) -> str:
+		self.count("cdn:playlist")
+		lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10",
+			"#EXT-X-PLAYLIST-TYPE:EVENT", "#EXT-X-MEDIA-SEQUENCE:0"]
+		for i in range(self.segments_per_vod):
+			lines += ["#EXTINF:10.000,", f"{i}.ts"]
+		lines.append("#EXT-X-ENDLIST")
+		return "\n".join(lines) + "\n"
+
+
+def _handler(server: StandInServer):
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+		# headers and bodies are written separately, kept-alive connections would stall on Nagle
+		disable_nagle_algorithm = True
+
+		def log_message(self, format, *args):
+			pass
+
+		def _send(self, status: int, body: bytes, content_type: str):
+			self.send_response(status)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_POST(self):
+			time.sleep(server.latency)
+			length = int(self.headers.get("Content-Length", 0))
+			body = json.loads(self.rfile.read(length) or b"{}")
+
+			if self.path != "/gql":
+				return self._send(404, b"{}", "application/json")
+			resp = server.gql(body.get("query", ""))
+			self._send(400 if "errors" in resp else 200, json.dumps(resp).encode(), "application/json")
+
+		def do_GET(self):
+			time.sleep(server.latency)
+			path = self.path.split("?")[0]
+			parts = path.strip("/").split("/")
+
+			if parts[0] == "vod" and len(parts) == 2:
+				return self._send(200, server.master_playlist(parts[1]).encode(), "application/vnd.apple.mpegurl")
+			if parts[0] == "cdn" and path.endswith(".m3u8"):
+				return self._send(200, server.media_playlist().encode(), "application/vnd.apple.mpegurl")
+			if parts[0] == "cdn" and path.endswith(".ts"):
+				return self._send_segment()
+			self._send(404, b"", "text/plain")
+
+		def _send_segment(self):
+			server.count("cdn:segment")
+			body = server._segment
+			fail = server.should_fail()
+
+			self.send_response(200)
+			self.send_header("Content-Type", "video/mp2t")
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+
+			# send in slices so bandwidth can be limited and connections cut partway through
+			step = 64 * 1024
+			if server.bandwidth:
+				step = max(TS_PACKET_SIZE, min(step, server.bandwidth // 20))
+			limit = len(body) // 2 if fail else len(body)
+			start = time.monotonic()
+			sent = 0
+			while sent < limit:
+				chunk = body[sent:min(sent + step, limit)]
+				self.wfile.write(chunk)
+				sent += len(chunk)
+				if server.bandwidth:
+					ahead = sent / server.bandwidth - (time.monotonic() - start)
+					if ahead > 0:
+						time.sleep(ahead)
+
+			if fail:
+				server.count("cdn:segment_cut")
+				self.wfile.flush()
+				self.connection.shutdown(socket.SHUT_RDWR)
+				self.close_connection = True
+
+	return Handler
@@ -1,69 +1,70 @@
-from . import util, __project__, __version__
-from .config import DEFAULT_CONFIG_PATH
+# Heavier modules (util, config, cache, requests, etc.) are only imported once a command needs them,
+# so shell completion and light commands such as `stage list` start quickly.
+from . import fastload, __project__, __version__
+from .fastload import DEFAULT_CONFIG_PATH
 from .printer import colorize
-from .cache import load_cache
-from .itd import gql
 
+import sys
 import argparse
 import argcomplete
 from argcomplete.completers import FilesCompleter, DirectoriesCompleter
 from pathlib import Path
 from importlib import import_module
-from requests.exceptions import ConnectionError
 from shutil import which
 
 
-def video_completer(prefix, parsed_args, **kwargs):
-	# searches all vod and clip directories for meta files, and strips down the names to just the ID's
+def _load_completion_data(parsed_args):
+	# only the raw JSON of the config and cache is needed to complete ID's
 	conf = None
 	try:
-		conf = util.load_conf_wrapper(parsed_args.config)
+		conf = fastload.load_raw_conf(parsed_args.config)
 	except Exception as e:
 		argcomplete.warn(f"Failed to open/read/parse VodBot config, `{e}`.")
-		return
-	
+		return None, None
+
 	cache = None
 	try:
-		cache = load_cache(conf, False, True)
+		cache = fastload.load_raw_cache(fastload.get_directories(conf))
+	except FileNotFoundError:
+		cache = {}
 	except Exception as e:
 		argcomplete.warn(f"Failed to open/read/parse cache, `{e}`.")
+		return None, None
+
+	return conf, cache
+
+
+def video_completer(prefix, parsed_args, **kwargs):
+	# searches all vod and clip directories for meta files, and strips down the names to just the ID's
+	conf, cache = _load_completion_data(parsed_args)
+	if conf is None:
 		return
 
 	allvids = []
 
-	for channel in conf.channels:
-		login = channel.username
+	for login in fastload.get_channel_logins(conf):
+		channel = cache.get("channels", {}).get(login, {})
 
-		allvids += [d for d in cache.channels[login].vods if d.startswith(prefix)]
-		allvids += [d for d in cache.channels[login].clips if d.startswith(prefix)]
-		allvids += [d for d in cache.channels[login].slugs if d.startswith(prefix)]
+		allvids += [d for d in channel.get("vods", {}) if d.startswith(prefix)]
+		allvids += [d for d in channel.get("clips", {}) if d.startswith(prefix)]
+		allvids += [d for d in channel.get("slugs", {}) if d.startswith(prefix)]
 	
 	return allvids
 
 
 def stage_completer(prefix, parsed_args, **kwargs):
 	# searches stage directory for stage files, and strips down the names to just the ID's.
-	conf = None
-	try:
-		conf = util.load_conf_wrapper(parsed_args.config)
-	except Exception as e:
-		argcomplete.warn(f"Failed to open/read/parse VodBot config, `{e}`.")
-		return
-
-	cache = None
-	try:
-		cache = load_cache(conf, False, True)
-	except Exception as e:
-		argcomplete.warn(f"Failed to open/read/parse cache, `{e}`.")
+	conf, cache = _load_completion_data(parsed_args)
+	if conf is None:
 		return
 
-	stages = [d for d in cache.stages if d.startswith(prefix)]
+	stages = [d for d in cache.get("stages", []) if d.startswith(prefix)]
 
 	cmd = parsed_args.cmd
 	pushload = cmd == "push" or cmd == "upload"
 
 	addall = []
-	if (pushload or cmd == "export") and "all".startswith(prefix):
+	if (pushload or cmd == "export" or cmd == "thumbnail") and "all".startswith(prefix):
 		addall = ["all"]
 
 	addlogout = []
@@ -81,10 +82,16 @@ def deffered_main():
 	# Catch KeyboardInterrupts or connection failures, and report them cleanly
 	try:
 		main()
-	except ConnectionError:
-		util.exit_prog(-2, "Failed to connect to the Internet/Intranet/ARPAnet/etc.")
 	except KeyboardInterrupt:
+		from . import util
 		util.exit_prog(-1, "Interrupted by user.")
+	except Exception as e:
+		# requests is imported lazily, so its exceptions can only be checked for once it is loaded
+		requests_exceptions = sys.modules.get("requests.exceptions")
+		if requests_exceptions is not None and isinstance(e, requests_exceptions.ConnectionError):
+			from . import util
+			util.exit_prog(-2, "Failed to connect to the Internet/Intranet/ARPAnet/etc.")
+		raise
 
 
 def main():
@@ -102,7 +109,7 @@ def main():
 
 	# Subparsers for different commands
 	subparsers = parser.add_subparsers(title="command", dest="cmd", metavar="CMD",
-		help="command to run: init, info, pull, stage, or upload.")
+		help="command to run: init, info, pull, watch, stage, upload, export, or thumbnail.")
 
 	# `vodbot init`
 	initparse = subparsers.add_parser("init", description="Runs the setup process for VodBot")
@@ -114,6 +121,15 @@ def main():
 	download.add_argument("type", type=str, default="both", nargs="?", choices=("vods", "clips", "both"),
 		help='what type of content to pull, can be "vods", "clips", or "both"')
 
+	# `vodbot watch <vods/clips/both> [--interval 600] [--jitter 0.1]`
+	watch = subparsers.add_parser("watch", description="Keeps running, pulling new VODs and/or clips as they're published.")
+	watch.add_argument("type", type=str, default="both", nargs="?", choices=("vods", "clips", "both"),
+		help='what type of content to pull, can be "vods", "clips", or "both"')
+	watch.add_argument("-i", "--interval", type=float, default=600, dest="interval", metavar="SECS",
+		help="seconds between checks of each channel, defaults to 600")
+	watch.add_argument("-j", "--jitter", type=float, default=0.1, dest="jitter", metavar="FRAC",
+		help="fraction of the interval each check is randomly moved by, defaults to 0.1")
+
 	# `vodbot stage`
 	stager = subparsers.add_parser("stage",
 		description="Stages sections of video to upload or export",)
@@ -162,6 +178,14 @@ def main():
 	export.add_argument("id", type=str, help="id of the staged video data, or `all` for all stages").completer = stage_completer
 	export.add_argument("path", type=Path, help="directory to export the video(s) to").completer = DirectoriesCompleter
 
+	# `vodbot thumbnail <stage_id/all> [path]`
+	thumbnail = subparsers.add_parser("thumbnail", description="Renders stage thumbnail(s) and a contact sheet for review.")
+	thumbnail.add_argument("id", type=str, help="id of the staged video data, or `all` for all stages").completer = stage_completer
+	thumbnail.add_argument("path", type=Path, nargs="?", default=None,
+		help="directory to write the thumbnails to, defaults to the temp directory").completer = DirectoriesCompleter
+	thumbnail.add_argument("-w", "--workers", type=int, default=None, dest="workers", metavar="N",
+		help="number of processes to render with, defaults to the number of cores")
+
 	# `vodbot info <vod/clip/channel_id/url>`
 	info = subparsers.add_parser("info", description="Prints out info on the Channel, Clip, or VOD given.")
 	info.add_argument("id", type=str, help="id/url of the Channel, Clip, or VOD")
@@ -169,6 +193,13 @@ def main():
 	argcomplete.autocomplete(parser)
 	args = parser.parse_args()
 
+	# listing stages needs nothing but the stage files, so skip the rest of startup
+	if args.cmd == "stage" and args.action == "list":
+		import_module(".commands.stage_list", "vodbot").run(args)
+		return
+
+	from . import util
+
 	# Check for ffmpeg
 	ffmpeg_check = which("ffmpeg")
 	if ffmpeg_check is None:
@@ -178,18 +209,29 @@ def main():
 	if args.cmd == "init":
 		import_module(".commands.init", "vodbot").run(args)
 	elif args.cmd == "pull" or args.cmd == "download":
+		from .itd import gql
 		try:
 			import_module(".commands.pull", "vodbot").run(args)
 		except gql.GQLItemError as e:
 			util.exit_prog(53, f"Failed to query a specific item using GQL: {e}")
 		except gql.GQLException as e:
 			util.exit_prog(54, f"Generic GQL Exception: {e}")
+	elif args.cmd == "watch":
+		from .itd import gql
+		try:
+			import_module(".commands.watch", "vodbot").run(args)
+		except gql.GQLItemError as e:
+			util.exit_prog(53, f"Failed to query a specific item using GQL: {e}")
+		except gql.GQLException as e:
+			util.exit_prog(54, f"Generic GQL Exception: {e}")
 	elif args.cmd == "stage":
 		import_module(".commands.stage", "vodbot").run(args)
 	elif args.cmd == "push" or args.cmd == "upload":
 		import_module(".commands.upload", "vodbot").run(args)
 	elif args.cmd == "export" or args.cmd == "slice":
 		import_module(".commands.export", "vodbot").run(args)
+	elif args.cmd == "thumbnail":
+		import_module(".commands.thumbnail", "vodbot").run(args)
 	elif args.cmd == "info":
 		import_module(".commands.info", "vodbot").run(args)
 	else:
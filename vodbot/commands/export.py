@@ -10,6 +10,7 @@ import vodbot.thumbnail as vbthumbnail
 from vodbot.config import Config
 from vodbot.printer import cprint
 from vodbot.cache import load_cache, save_cache
+from vodbot.metrics import init_metrics
 
 from datetime import datetime
 from pathlib import Path
@@ -59,6 +60,7 @@ def handle_stage(conf: Config, stage: StageData) -> Path:
 def run(args):
 	conf = util.load_conf(args.config)
 	cache = load_cache(conf, args.cache_toggle)
+	init_metrics(conf, "export")
 	STAGE_DIR = conf.directories.stage
 
 	util.make_dir(args.path)
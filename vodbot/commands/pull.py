@@ -1,18 +1,25 @@
 # Pull, downloads VODs and Clips from Twitch.tv
 
-from typing import List
-from vodbot import util, twitch
+from typing import List, Tuple
+from vodbot import util, twitch, journal
+from vodbot.config import Config
 from vodbot.itd import download as itd_dl, worker as itd_work
 from vodbot.printer import cprint
 from vodbot.itd.gql import set_client_id
+from vodbot.itd.bandwidth import init_bandwidth
 from vodbot.cache import Cache, load_cache, save_cache, _CacheChannel
+from vodbot.metrics import init_metrics
 from vodbot.webhook import init_webhooks, send_pull_clip, send_pull_error, send_pull_job_done, send_pull_vod
 
+import json
 from os import listdir
 from os.path import isfile
 
 
-def run(args):
+def setup(args, command: str="pull"):
+	"""
+	Loads the config and cache, and prepares the channels and directories for pulling.
+	"""
 	# Load the config and set up the access token
 	cprint("#r#dLoading config...#r", end=" ", flush=True)
 	conf = util.load_conf(args.config)
@@ -27,6 +34,8 @@ be changed in your configuration file, read more on the wiki page on GitHub.
 
 	cache: Cache = load_cache(conf, args.cache_toggle)
 	init_webhooks(conf)
+	init_metrics(conf, command)
+	init_bandwidth(conf)
 	VODS_DIR = conf.directories.vods
 	CLIPS_DIR = conf.directories.clips
 	TEMP_DIR = conf.directories.temp
@@ -53,6 +62,246 @@ be changed in your configuration file, read more on the wiki page on GitHub.
 	util.make_dir(TEMP_DIR)
 	util.make_dir(VODS_DIR)
 	util.make_dir(CLIPS_DIR)
+	journal.init_journal(conf)
+
+	return conf, cache, channels
+
+
+def resume(conf: Config, cache: Cache, channels: List[twitch.Channel]) -> None:
+	"""
+	Finishes pulling the VODs and Clips that a killed pull left in the journal, from the step each
+	one stopped at, without listing any channel again.
+	"""
+	jobs = journal.jobs()
+	if not jobs:
+		return
+
+	cprint(f"#r#dResuming {len(jobs)} video(s) left by the last pull...#r", flush=True)
+	fin_vods = fin_clips = all_vods = all_clips = 0
+	for channel in channels:
+		mine = [job for job in jobs.values() if job["channel"] == channel.login]
+		channel.new_vods = [twitch.Vod.from_meta(job["meta"]) for job in mine if job["kind"] == "vod"]
+		channel.new_clips = [twitch.Clip.from_meta(job["meta"]) for job in mine if job["kind"] == "clip"]
+		channel.live_vods = []
+		if not mine:
+			continue
+
+		all_vods += len(channel.new_vods)
+		all_clips += len(channel.new_clips)
+		done_vods, done_clips = pull_channel(conf, cache, channel)
+		fin_vods += done_vods
+		fin_clips += done_clips
+
+	save_cache(conf, cache)
+	journal.clear_journal()
+	send_pull_job_done(fin_vods, fin_clips, all_vods, all_clips)
+
+
+def list_channel(conf: Config, cache: Cache, channel: twitch.Channel, pull_type: str,
+	since: str=None, clip_period: str="ALL_TIME", live: bool=False) -> Tuple[int, int]:
+	"""
+	Lists the VODs and Clips of a channel that haven't been pulled yet, and keeps them on the channel
+	for `pull_channel`. `since` and `clip_period` limit how far back the channel is listed. With
+	`live`, VODs still being recorded are kept on the channel separately, and aren't counted.
+	"""
+	VODS_DIR = conf.directories.vods
+	CLIPS_DIR = conf.directories.clips
+	atboth = pull_type == "both"
+	atvods = pull_type == "vods"
+	atclips = pull_type == "clips"
+
+	channel.new_vods = []
+	channel.new_clips = []
+	channel.live_vods = []
+
+	getvods = conf.pull.save_vods and channel.save_vods
+	getchat = conf.pull.save_chat and channel.save_chat
+	getclips = conf.pull.save_clips and channel.save_clips
+	# getany = getvods or getchat or getclips
+	# getall = getvods and getchat and getclips
+
+	if not (getvods or getchat or getclips):
+		return 0, 0
+
+	cprint(f"#fY#l{channel.display_name}#r:", end=" ", flush=True)
+
+	newvods = []
+	if (atboth or atvods) and (getvods or getchat):
+		voddir = VODS_DIR / channel.login
+		util.make_dir(voddir)
+
+		cached = cache.channels[channel.login].vods
+		channelvods = twitch.get_channel_vods(channel, since=since, skip=cached, recording=live and getvods)
+		newvods = compare_existant_file(voddir, channelvods)
+		channel.live_vods = [vod for vod in newvods if vod.recording]
+		newvods = [vod for vod in newvods if not vod.recording]
+
+		cprint(f"#fC#l{len(newvods)} #fM#lVODs#r", end="", flush=True)
+		if channel.live_vods:
+			cprint(f" (#fC#l{len(channel.live_vods)}#r live)", end="", flush=True)
+	
+	if atboth and ((getvods or getchat) and getclips):
+		cprint(" & ", end="", flush=True)
+	
+	newclips = []
+	if (atboth or atclips) and getclips:
+		clipdir = CLIPS_DIR / channel.login
+		util.make_dir(clipdir)
+
+		channelclips = [clip for clip in twitch.get_channel_clips(channel, period=clip_period) if clip.id not in cache.channels[channel.login].clips]
+		newclips = compare_existant_file(clipdir, channelclips)
+
+		cprint(f"#fC#l{len(newclips)} #fM#lClips#r", end="", flush=True)
+	
+	print(flush=True)
+	
+	channel.new_vods = newvods
+	channel.new_clips = newclips
+	journal.jobs_listed("vod", channel.login, newvods)
+	journal.jobs_listed("clip", channel.login, newclips)
+
+	return len(newvods), len(newclips)
+
+
+def pull_channel(conf: Config, cache: Cache, channel: twitch.Channel) -> Tuple[int, int]:
+	"""
+	Pulls the VODs and Clips listed for a channel by `list_channel`, returning how many of each
+	were pulled successfully.
+	"""
+	VODS_DIR = conf.directories.vods
+	CLIPS_DIR = conf.directories.clips
+	fin_vods = fin_clips = 0
+
+	voddir = VODS_DIR / channel.login
+	for vod in channel.new_vods:
+		filepath = voddir / f"{vod.created_at}_{vod.id}".replace(":", ";")
+		filename = str(filepath) + ".mkv"
+		metaname = str(filepath) + ".meta"
+		chatname = str(filepath) + ".chat"
+		cachename = f"{vod.created_at}_{vod.id}.meta".replace(":", ";")
+		# steps a killed pull already got done for this VOD
+		steps = journal.job_steps(vod.id)
+		if "done" in steps:
+			cache.channels[channel.login].vods[vod.id] = cachename
+			continue
+
+		# download chat
+		if conf.pull.save_chat and channel.save_chat:
+			if "chat" not in steps:
+				itd_dl.dl_video_chat(vod, chatname)
+				journal.job_step(vod.id, "chat")
+			vod.has_chat = True
+		# download video
+		if "joined" in steps:
+			vod.muted = steps["joined"].get("muted", [])
+		elif conf.pull.save_vods and channel.save_vods:
+			try:
+				itd_dl.dl_video(conf, vod, filename)
+				journal.job_step(vod.id, "joined", muted=vod.muted)
+			except itd_dl.JoiningFailed:
+				cprint(f"#fR#lVOD `{vod.id}` joining failed! Skipping...#r")
+				send_pull_error(f'Failed to join VOD files for "{vod.id}". Files have been preserved and VOD has been skipped.', vod.url)
+				continue
+			except itd_work.DownloadFailed:
+				cprint(f"#fR#lVOD `{vod.id}` download failed! Skipping...#r")
+				send_pull_error(f'Failed to download VOD files for "{vod.id}". VOD has been skipped.', vod.url)
+				continue
+			except itd_work.TwitchAccessDenied:
+				cprint(f"#fR#lVOD `{vod.id}` download failed! Twitch is denying access to a public video, contact Twitch Support. Skipping...#r")
+				send_pull_error(f'Failed to download VOD files for "{vod.id}", due to Twitch denying access to a public video. VOD has been skipped.', vod.url)
+				continue
+			except (itd_work.DownloadCancelled, KeyboardInterrupt):
+				cprint(f"\n#fR#lVOD `{vod.id}` download cancelled. Exiting...#r")
+				save_cache(conf, cache)
+				send_pull_error(f'Pull cancelled during download of VOD "{vod.id}".', vod.url)
+				raise KeyboardInterrupt()
+		# write meta file
+		vod.write_meta(metaname)
+		journal.job_step(vod.id, "done")
+		# write to cache
+		cache.channels[channel.login].vods[vod.id] = cachename
+		# send webhook
+		send_pull_vod(vod)
+		fin_vods += 1
+
+	clipdir = CLIPS_DIR / channel.login
+	for clip in channel.new_clips:
+		filepath = clipdir / f"{clip.created_at}_{clip.id}".replace(":", ";")
+		filename = str(filepath) + ".mkv"
+		metaname = str(filepath) + ".meta"
+		cachename = f"{clip.created_at}_{clip.id}.meta".replace(":", ";")
+		if "done" in journal.job_steps(clip.id):
+			cache.channels[channel.login].clips[clip.id] = cachename
+			cache.channels[channel.login].slugs[clip.slug] = cachename
+			continue
+
+		# download clip
+		if conf.pull.save_clips and channel.save_clips:
+			try:
+				itd_dl.dl_clip(conf, clip, filename, clip_source(conf, cache, channel, clip))
+			except itd_work.DownloadFailed:
+				cprint(f"#fR#lClip `{clip.slug}` ({clip.id}) download failed! Skipping...#r")
+				send_pull_error(f'Failed to download Clip file for `{clip.slug}` ({clip.id}). Clip has been skipped.', clip.url)
+			except itd_work.TwitchAccessDenied:
+				cprint(f"#fR#lClip `{clip.slug}` ({clip.id}) download failed! Twitch is denying access to a public video, contact Twitch Support. Skipping...#r")
+				send_pull_error(f'Failed to download Clip file for `{clip.slug}` ({clip.id}), due to Twitch denying access to a public video. Clip has been skipped.', clip.url)
+				continue
+			except (itd_work.DownloadCancelled, KeyboardInterrupt):
+				cprint(f"\n#fR#lClip `{clip.slug}` ({clip.id}) download cancelled. Exiting...#r")
+				save_cache(conf, cache)
+				send_pull_error(f'Pull cancelled during download of Clip "{clip.slug}" ({clip.id}).', clip.url)
+				raise KeyboardInterrupt()
+		# write meta file
+		clip.write_meta(metaname)
+		journal.job_step(clip.id, "done")
+		# write to cache
+		cache.channels[channel.login].clips[clip.id] = cachename
+		cache.channels[channel.login].slugs[clip.slug] = cachename
+		# send webhook
+		send_pull_clip(clip)
+		fin_clips += 1
+
+	return fin_vods, fin_clips
+
+
+def clip_source(conf: Config, cache: Cache, channel: twitch.Channel, clip: twitch.Clip) -> str:
+	"""
+	Returns the path of the pulled VOD a Clip can be cut from, or None if it has to be downloaded.
+	"""
+	if not conf.pull.clips_from_vods or not clip.video_id:
+		return None
+
+	metaname = cache.channels[channel.login].vods.get(clip.video_id)
+	if metaname is None:
+		return None
+	metapath = conf.directories.vods / channel.login / metaname
+	vodpath = metapath.with_suffix(".mkv")
+	if not isfile(vodpath):
+		return None
+
+	try:
+		with open(metapath) as f:
+			meta = json.load(f)
+	except (OSError, ValueError):
+		return None
+
+	# the cut would come out silent where Twitch muted the VOD, the Clip itself isn't
+	end = clip.offset + clip.length
+	if end > meta.get("length", 0):
+		return None
+	# metas written before muted sections were recorded can't say whether the Clip is in one
+	if "muted" not in meta:
+		return None
+	for muted in meta["muted"]:
+		if muted["pos"] < end and clip.offset < muted["pos"] + muted["dur"]:
+			return None
+
+	return str(vodpath)
+
+
+def run(args):
+	conf, cache, channels = setup(args)
+	resume(conf, cache, channels)
 
 	cprint("#r#dPulling video lists...#r", flush=True)
 	# Get list of videos using channel object ID's from Twitch API
@@ -63,46 +312,9 @@ be changed in your configuration file, read more on the wiki page on GitHub.
 	atclips = args.type == "clips"
 
 	for channel in channels:
-		getvods = conf.pull.save_vods and channel.save_vods
-		getchat = conf.pull.save_chat and channel.save_chat
-		getclips = conf.pull.save_clips and channel.save_clips
-		# getany = getvods or getchat or getclips
-		# getall = getvods and getchat and getclips
-
-		if not (getvods or getchat or getclips):
-			continue
-
-		cprint(f"#fY#l{channel.display_name}#r:", end=" ", flush=True)
-
-		newvods = []
-		if (atboth or atvods) and (getvods or getchat):
-			voddir = VODS_DIR / channel.login
-			util.make_dir(voddir)
-
-			channelvods = [vod for vod in twitch.get_channel_vods(channel) if vod.id not in cache.channels[channel.login].vods]
-			newvods = compare_existant_file(voddir, channelvods)
-
-			totalvods += len(newvods)
-			cprint(f"#fC#l{len(newvods)} #fM#lVODs#r", end="", flush=True)
-		
-		if atboth and ((getvods or getchat) and getclips):
-			cprint(" & ", end="", flush=True)
-		
-		newclips = []
-		if (atboth or atclips) and getclips:
-			clipdir = CLIPS_DIR / channel.login
-			util.make_dir(clipdir)
-
-			channelclips = [clip for clip in twitch.get_channel_clips(channel) if clip.id not in cache.channels[channel.login].clips]
-			newclips = compare_existant_file(clipdir, channelclips)
-
-			totalclips += len(newclips)
-			cprint(f"#fC#l{len(newclips)} #fM#lClips#r", end="", flush=True)
-		
-		print(flush=True)
-		
-		channel.new_vods = newvods
-		channel.new_clips = newclips
+		newvods, newclips = list_channel(conf, cache, channel, args.type)
+		totalvods += newvods
+		totalclips += newclips
 	
 	if atboth:
 		cprint(f"Total #fMVODs#r to pull: #fC#l{totalvods}#r")
@@ -118,88 +330,21 @@ be changed in your configuration file, read more on the wiki page on GitHub.
 		cprint("#r#dPulling videos...#r", flush=True)
 	fin_vods = fin_clips = all_vods = all_clips = 0
 	for channel in channels:
-		if ((hasattr(channel, "new_vods") and len(channel.new_vods) > 0) or
-			(hasattr(channel, "new_clips") and len(channel.new_clips) > 0)):
+		if len(channel.new_vods) > 0 or len(channel.new_clips) > 0:
 			cprint(f"Pulling videos for #fY#l{channel.display_name}#r...")
 		else:
 			continue
 
-		voddir = VODS_DIR / channel.login
 		all_vods += len(channel.new_vods)
-		for vod in channel.new_vods:
-			filepath = voddir / f"{vod.created_at}_{vod.id}".replace(":", ";")
-			filename = str(filepath) + ".mkv"
-			metaname = str(filepath) + ".meta"
-			chatname = str(filepath) + ".chat"
-
-			# download chat
-			if conf.pull.save_chat and channel.save_chat:
-				itd_dl.dl_video_chat(vod, chatname)
-				vod.has_chat = True
-			# download video
-			if conf.pull.save_vods and channel.save_vods:
-				try:
-					itd_dl.dl_video(conf, vod, filename)
-				except itd_dl.JoiningFailed:
-					cprint(f"#fR#lVOD `{vod.id}` joining failed! Skipping...#r")
-					send_pull_error(f'Failed to join VOD files for "{vod.id}". Files have been preserved and VOD has been skipped.', vod.url)
-					continue
-				except itd_work.DownloadFailed:
-					cprint(f"#fR#lVOD `{vod.id}` download failed! Skipping...#r")
-					send_pull_error(f'Failed to download VOD files for "{vod.id}". VOD has been skipped.', vod.url)
-					continue
-				except itd_work.TwitchAccessDenied:
-					cprint(f"#fR#lVOD `{vod.id}` download failed! Twitch is denying access to a public video, contact Twitch Support. Skipping...#r")
-					send_pull_error(f'Failed to download VOD files for "{vod.id}", due to Twitch denying access to a public video. VOD has been skipped.', vod.url)
-					continue
-				except (itd_work.DownloadCancelled, KeyboardInterrupt):
-					cprint(f"\n#fR#lVOD `{vod.id}` download cancelled. Exiting...#r")
-					save_cache(conf, cache)
-					send_pull_error(f'Pull cancelled during download of VOD "{vod.id}".', vod.url)
-					raise KeyboardInterrupt()
-			# write meta file
-			vod.write_meta(metaname)
-			# write to cache
-			cache.channels[channel.login].vods[vod.id] = f"{vod.created_at}_{vod.id}.meta".replace(":", ";")
-			# send webhook
-			send_pull_vod(vod)
-			fin_vods += 1
-
-		clipdir = CLIPS_DIR / channel.login
 		all_clips += len(channel.new_clips)
-		for clip in channel.new_clips:
-			filepath = clipdir / f"{clip.created_at}_{clip.id}".replace(":", ";")
-			filename = str(filepath) + ".mkv"
-			metaname = str(filepath) + ".meta"
-
-			# download clip
-			if conf.pull.save_clips and channel.save_clips:
-				try:
-					itd_dl.dl_clip(conf, clip, filename)
-				except itd_work.DownloadFailed:
-					cprint(f"#fR#lClip `{clip.slug}` ({clip.id}) download failed! Skipping...#r")
-					send_pull_error(f'Failed to download Clip file for `{clip.slug}` ({clip.id}). Clip has been skipped.', clip.url)
-				except itd_work.TwitchAccessDenied:
-					cprint(f"#fR#lClip `{clip.slug}` ({clip.id}) download failed! Twitch is denying access to a public video, contact Twitch Support. Skipping...#r")
-					send_pull_error(f'Failed to download Clip file for `{clip.slug}` ({clip.id}), due to Twitch denying access to a public video. Clip has been skipped.', clip.url)
-					continue
-				except (itd_work.DownloadCancelled, KeyboardInterrupt):
-					cprint(f"\n#fR#lClip `{clip.slug}` ({clip.id}) download cancelled. Exiting...#r")
-					save_cache(conf, cache)
-					send_pull_error(f'Pull cancelled during download of Clip "{clip.slug}" ({clip.id}).', clip.url)
-					raise KeyboardInterrupt()
-			# write meta file
-			clip.write_meta(metaname)
-			# write to cache
-			cache.channels[channel.login].clips[clip.id] = f"{clip.created_at}_{clip.id}.meta".replace(":", ";")
-			cache.channels[channel.login].slugs[clip.slug] = f"{clip.created_at}_{clip.id}.meta".replace(":", ";")
-			# send webhook
-			send_pull_clip(clip)
-			fin_clips += 1
+		done_vods, done_clips = pull_channel(conf, cache, channel)
+		fin_vods += done_vods
+		fin_clips += done_clips
 
 	#cprint("\n#fM#l* All done, goodbye! *#r\n")
 	# save the cache
 	save_cache(conf, cache)
+	journal.clear_journal()
 	send_pull_job_done(fin_vods, fin_clips, all_vods, all_clips)
 
 
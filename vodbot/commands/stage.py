@@ -4,6 +4,7 @@ from vodbot.cache import Cache, load_cache, save_cache
 import vodbot.util as util
 from vodbot.config import DEFAULT_CONFIG_DIRECTORY, _ConfigThumbnailIcon, Config
 from vodbot.printer import cprint, colorize
+from .stage_list import list_stages
 
 import re
 import json
@@ -668,23 +669,10 @@ def _new(args, conf: Config, cache: Cache):
 def _list(args, conf:Config, cache: Cache):
 	STAGE_DIR = conf.directories.stage
 
-	if args.id == None:
-		stages = StageData.load_all_stages(STAGE_DIR)
+	if args.id != None and not isfile(str(STAGE_DIR / f"{args.id}.stage")):
+		util.exit_prog(46, f'Could not find stage "{args.id}". (FileNotFound)')
 
-		for s in stages:
-			cprint(f'#r#fY#l{s.id}#r -- `#fC{s.title}#r` ', end="")
-			cprint(f'(#fM{" ".join([d.video_id for d in s.slices])}#r) -- ', end="")
-			cprint(f'#l#fM{", ".join(s.streamers)}#r')
-		
-		if len(stages) == 0:
-			cprint("#fBNothing staged right now.#r")
-	else:
-		stage = StageData.load_from_id(STAGE_DIR, args.id)
-
-		cprint(f"#r`#fC{stage.title}#r` #fM{' '.join(stage.streamers)}#r #d({stage.id})#r")
-		cprint(f"#d'''#fG{stage.desc}#r#d'''#r")
-		for vid in stage.slices:
-			cprint(f"#fM{vid.video_id}#r > #fY{vid.ss}#r - #fY{vid.to}#r")
+	list_stages(STAGE_DIR, args.id)
 
 
 def run(args):
@@ -0,0 +1,48 @@
+# Stage listing, kept apart from the rest of staging so it can run without loading the full config
+
+from vodbot import fastload
+from vodbot.printer import cprint
+
+from importlib import import_module
+from os import listdir as os_listdir
+from os.path import isfile
+from pathlib import Path
+
+
+def list_stages(stagedir: Path, sid: str=None) -> None:
+	# everything is formatted before anything is printed, a stage that fails to parse partway
+	# through falls back to the full stage command without having printed half of itself
+	lines = []
+	if sid is None:
+		stages = [fastload.load_raw_stage(stagedir, d[:-6])
+			for d in os_listdir(stagedir) if isfile(stagedir / d) and d.endswith(".stage")]
+
+		for s in stages:
+			lines.append(f'#r#fY#l{s["id"]}#r -- `#fC{s["title"]}#r` '
+				f'(#fM{" ".join([d["video_id"] for d in s["slices"]])}#r) -- '
+				f'#l#fM{", ".join(s["streamers"])}#r')
+
+		if len(stages) == 0:
+			lines.append("#fBNothing staged right now.#r")
+	else:
+		stage = fastload.load_raw_stage(stagedir, sid)
+
+		lines.append(f"#r`#fC{stage['title']}#r` #fM{' '.join(stage['streamers'])}#r #d({stage['id']})#r")
+		lines.append(f"#d'''#fG{stage['desc']}#r#d'''#r")
+		for vid in stage["slices"]:
+			lines.append(f"#fM{vid['video_id']}#r > #fY{vid['ss']}#r - #fY{vid['to']}#r")
+
+	for line in lines:
+		cprint(line)
+
+
+def run(args):
+	# the full stage command handles cache updates and reports config or stage errors properly
+	if args.cache_toggle:
+		return import_module(".commands.stage", "vodbot").run(args)
+
+	try:
+		stagedir = fastload.get_directories(fastload.load_raw_conf(args.config))["stage"]
+		list_stages(stagedir, args.id)
+	except (OSError, ValueError, KeyError, TypeError, AttributeError):
+		return import_module(".commands.stage", "vodbot").run(args)
@@ -0,0 +1,107 @@
+# Thumbnail, renders stage thumbnails on their own for review
+
+from .export import sort_stagedata
+from .stage import StageData
+
+import vodbot.util as util
+import vodbot.thumbnail as vbthumbnail
+from vodbot.config import Config
+from vodbot.printer import cprint
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import ceil, sqrt
+from pathlib import Path
+from shutil import move as shutil_move
+from typing import List, Tuple
+from PIL import Image, ImageDraw
+
+
+CONTACT_SHEET_NAME = "contact_sheet.png"
+CONTACT_SHEET_COLUMNS = 5
+CONTACT_SHEET_TILE_WIDTH = 320
+CONTACT_SHEET_LABEL_HEIGHT = 20
+
+
+def _render(conf: Config, stage: StageData) -> Path:
+	# runs in a worker process, its assets were cached once by the pool's initializer
+	try:
+		return vbthumbnail.generate_thumbnail(conf, stage)
+	except vbthumbnail.ScreengrabFailed:
+		cprint(f"#d#fYWARN: Failed to get screenshot from video with FFMPEG for stage `{stage.id}`. Skipping...#r")
+		return None
+
+
+def make_contact_sheet(conf: Config, thumbnails: List[Tuple[StageData, Path]], path: Path) -> Path:
+	cols = min(CONTACT_SHEET_COLUMNS, ceil(sqrt(len(thumbnails))))
+	rows = ceil(len(thumbnails) / cols)
+	tw = CONTACT_SHEET_TILE_WIDTH
+	th = int(tw * conf.thumbnail.canvas_height / conf.thumbnail.canvas_width)
+	lh = CONTACT_SHEET_LABEL_HEIGHT
+
+	sheet = Image.new("RGBA", (cols * tw, rows * (th + lh)), (0,0,0,255))
+	d = ImageDraw.Draw(sheet)
+	for i, (stage, tnpath) in enumerate(thumbnails):
+		x, y = (i % cols) * tw, (i // cols) * (th + lh)
+		with Image.open(tnpath) as tn:
+			tn.thumbnail((tw, th), Image.BICUBIC)
+			sheet.paste(tn, (x, y))
+		d.text((x + 4, y + th + 4), f"{stage.id} - {stage.title}", fill=(255,255,255,255))
+
+	sheet.save(path)
+	return path
+
+
+def run(args):
+	conf = util.load_conf(args.config)
+	STAGE_DIR = conf.directories.stage
+
+	if args.path is None:
+		args.path = conf.directories.temp
+	args.path = Path(args.path)
+	util.make_dir(args.path)
+	util.make_dir(conf.directories.temp)
+
+	# Handle id/all
+	cprint("#dLoading stages...#r", end=" ", flush=True)
+	stagedatas = []
+	if args.id == "all":
+		stagedatas = StageData.load_all_stages(STAGE_DIR)
+		stagedatas.sort(key=sort_stagedata)
+	else:
+		stagedatas = [StageData.load_from_id(STAGE_DIR, args.id)]
+	stagedatas = [s for s in stagedatas if s.thumbnail]
+	cprint(f"#drendering {len(stagedatas)} thumbnail(s)...#r")
+
+	if not stagedatas:
+		cprint("#fBNo stages with thumbnail data to render.#r")
+		return
+
+	# every worker warms its own asset cache once, whether it was forked or spawned
+	thumbnails = []
+	with ProcessPoolExecutor(max_workers=args.workers,
+		initializer=vbthumbnail.preload_assets, initargs=(conf,)) as executor:
+		futures = {executor.submit(_render, conf, stage): stage for stage in stagedatas}
+		for future in as_completed(futures):
+			stage = futures[future]
+			try:
+				tmpnail = future.result()
+			except Exception as e:
+				# one stage failing to render shouldn't cost the rest of the sheet
+				cprint(f"#d#fYWARN: Failed to render thumbnail for stage `{stage.id}`, {e}. Skipping...#r")
+				continue
+			if tmpnail is None:
+				continue
+
+			finalpath = args.path / f"{stage.id}{tmpnail.suffix}"
+			shutil_move(str(tmpnail), str(finalpath))
+			thumbnails.append((stage, finalpath))
+			cprint(f"#fGRendered thumbnail for#r `#fM{stage.id}#r` #d({finalpath})#r")
+
+	if not thumbnails:
+		util.exit_prog(36, "Failed to render any thumbnails.")
+
+	# keep the sheet in the same order the stages would upload in
+	order = {s.id: i for i, s in enumerate(stagedatas)}
+	thumbnails.sort(key=lambda t: order[t[0].id])
+	sheet = make_contact_sheet(conf, thumbnails, args.path / CONTACT_SHEET_NAME)
+	cprint(f"#fG#lContact sheet written to#r `{sheet}`")
@@ -9,26 +9,34 @@ from .stage import StageData
 import vodbot.video as vbvid
 import vodbot.chatlog as vbchat
 import vodbot.thumbnail as vbthumbnail
-from vodbot.util import exit_prog, load_conf, format_size
+import vodbot.metrics as metrics
+from vodbot.util import exit_prog, load_conf
 from vodbot.cache import load_cache, save_cache
 from vodbot.printer import cprint
+from vodbot.progress import ProgressReporter
 from vodbot.config import Config
 from vodbot.webhook import init_webhooks, send_upload_error, send_upload_video, send_upload_job_done
 
 import base64
+import hashlib
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from dataclasses_json import dataclass_json
 from datetime import datetime
-from os import remove as os_remove
+from os import remove as os_remove, stat as os_stat
 from os.path import exists as os_exists
-from time import sleep
-from typing import List
+from pathlib import Path
+from threading import Lock, local
+from time import monotonic, sleep
+from typing import Dict, List, Union
 
 from httplib2.error import HttpLib2Error, HttpLib2ErrorWithResponse
 
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build, Resource
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaUpload
 from googleapiclient.errors import HttpError, ResumableUploadError
 from google.auth.transport.requests import Request
 from google.auth.exceptions import RefreshError
@@ -37,6 +45,178 @@ from google.oauth2.credentials import Credentials
 
 RETRIABLE_EXCEPTS = (HttpLib2Error, HttpLib2ErrorWithResponse, IOError)
 
+# Quota cost of each type of request made to the YouTube Data API, in units.
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+	"videos.insert": 1600,
+	"thumbnails.set": 50,
+	"captions.insert": 400,
+}
+# API error reasons for running out of quota for the day, and for being rate limited.
+QUOTA_ERRORS = ["quotaExceeded", "dailyLimitExceeded"]
+RATE_LIMIT_ERRORS = ["rateLimitExceeded", "userRateLimitExceeded", "uploadRateLimitExceeded"]
+
+
+class UploadFatal(Exception):
+	"""
+	An API error that retrying won't fix. Raised from wherever the upload runs, and turned into an
+	exit by the main thread so that uploads running alongside it are stopped too.
+	"""
+	pass
+
+
+class UploadScheduler:
+	"""
+	Quota and rate limit state shared by every stage being uploaded at once. Quota for a whole
+	stage is reserved before it starts, so a video is never uploaded without the quota left for
+	its thumbnail and captions. Rate limiting pauses every upload, not just the one that hit it.
+	"""
+
+	def __init__(self, daily_quota: int, backoff_start: float=30, backoff_max: float=900) -> None:
+		self.daily_quota = daily_quota
+		self.used: Dict[str, int] = {k: 0 for k in QUOTA_COSTS}
+		self.reserved = 0
+		self.exhausted = False
+		self.cancelled = False
+		self._lock = Lock()
+		self._backoff_start = backoff_start
+		self._backoff_max = backoff_max
+		self._backoff = backoff_start
+		self._resume_at = 0
+
+	def reserve(self, request_types: List[str]) -> bool:
+		cost = sum(QUOTA_COSTS[t] for t in request_types)
+		with self._lock:
+			if self.exhausted or sum(self.used.values()) + self.reserved + cost > self.daily_quota:
+				return False
+			self.reserved += cost
+			return True
+
+	def charge(self, request_type: str) -> None:
+		# requests use up quota whether they succeed or not
+		with self._lock:
+			self.used[request_type] += QUOTA_COSTS[request_type]
+
+	def release(self, request_types: List[str]) -> None:
+		# reservations are held until the stage is done, whatever it used has been charged by then
+		with self._lock:
+			self.reserved = max(0, self.reserved - sum(QUOTA_COSTS[t] for t in request_types))
+
+	def exhaust(self) -> None:
+		with self._lock:
+			self.exhausted = True
+
+	def backoff(self) -> float:
+		with self._lock:
+			delay = self._backoff
+			self._resume_at = max(self._resume_at, monotonic() + delay)
+			self._backoff = min(self._backoff * 2, self._backoff_max)
+			return delay
+
+	def succeeded(self) -> None:
+		with self._lock:
+			self._backoff = self._backoff_start
+
+	def wait(self) -> None:
+		while not self.cancelled:
+			remaining = self._resume_at - monotonic()
+			if remaining <= 0:
+				return
+			sleep(min(remaining, 1))
+
+	def report(self) -> str:
+		used = ", ".join(f"{t} {u}" for t, u in self.used.items() if u)
+		return f"{sum(self.used.values())}/{self.daily_quota} quota units used" + (f" ({used})" if used else "")
+
+
+# Resumable upload chunks must be a multiple of this size, except for the last one.
+CHUNK_UNIT = 256 * 1024
+# Adapted chunks aim to take at least this many seconds, and this many round trips, to send, so the
+# overhead of each request stays small on fast links as well as high latency ones.
+CHUNK_TARGET_SECONDS = 4
+CHUNK_TARGET_RTTS = 20
+# Weight of the newest throughput sample in the running average.
+CHUNK_THROUGHPUT_WEIGHT = 0.3
+# Artifacts up to this size are sent in one plain request instead of a resumable session.
+SINGLE_REQUEST_MAX_SIZE = 8 * 1024 * 1024
+
+
+class ChunkSizer:
+	"""
+	Picks the size of each chunk of a resumable upload from the throughput and latency measured on
+	the chunks before it. Chunks at most double in size each step and are halved after an error.
+	"""
+
+	def __init__(self, media: Union['MediaFileSizedUpload', 'MediaStageStreamUpload'], minimum: int, maximum: int, enabled: bool=True):
+		self._media = media
+		self.minimum = max(CHUNK_UNIT, minimum // CHUNK_UNIT * CHUNK_UNIT)
+		self.maximum = max(self.minimum, maximum // CHUNK_UNIT * CHUNK_UNIT)
+		self.enabled = enabled
+		self.size = self.minimum
+		# running average of bytes per second
+		self.throughput = None
+		# quickest request seen, an upper bound on the round trip time
+		self.rtt = None
+		self._apply()
+
+	@staticmethod
+	def from_conf(conf: Config, media: Union['MediaFileSizedUpload', 'MediaStageStreamUpload']) -> 'ChunkSizer':
+		return ChunkSizer(media, conf.upload.chunk_size, conf.upload.max_chunk_size, conf.upload.adaptive_chunk_size)
+
+	def _apply(self):
+		# the API client asks the media for its chunk size before reading each chunk
+		self._media.chunk_size = self.size
+
+	def measure(self, sent: int, elapsed: float):
+		if not self.enabled or sent <= 0 or elapsed <= 0:
+			return
+
+		self.rtt = elapsed if self.rtt is None else min(self.rtt, elapsed)
+		sample = sent / elapsed
+		if self.throughput is None:
+			self.throughput = sample
+		else:
+			self.throughput += CHUNK_THROUGHPUT_WEIGHT * (sample - self.throughput)
+
+		target = max(CHUNK_TARGET_SECONDS, self.rtt * CHUNK_TARGET_RTTS) * self.throughput
+		size = min(int(target), self.size * 2, self.maximum)
+		self.size = max(self.minimum, size // CHUNK_UNIT * CHUNK_UNIT)
+		self._apply()
+
+	def failed(self):
+		# less to resend if the connection keeps dropping
+		if not self.enabled:
+			return
+		self.size = max(self.minimum, self.size // 2 // CHUNK_UNIT * CHUNK_UNIT)
+		self._apply()
+
+
+class MediaFileSizedUpload(MediaFileUpload):
+	"""
+	A file upload whose chunk size can change between chunks. The API client only reads it through
+	chunksize(), so a ChunkSizer sets chunk_size here rather than reaching into the client's own.
+	"""
+
+	def __init__(self, filename: str, chunksize: int, resumable: bool=False):
+		super().__init__(filename, chunksize=chunksize, resumable=resumable)
+		self.chunk_size = chunksize
+
+	def chunksize(self):
+		return self.chunk_size
+
+
+def _media_file(conf: Config, path: Path, resumable: bool=False) -> MediaFileSizedUpload:
+	# small artifacts go in one request, saving the round trips of starting a resumable session
+	if not resumable and os_stat(str(path)).st_size <= SINGLE_REQUEST_MAX_SIZE:
+		return MediaFileSizedUpload(str(path), conf.upload.chunk_size, resumable=False)
+	return MediaFileSizedUpload(str(path), conf.upload.chunk_size, resumable=True)
+
+
+# the scheduler for the current run, replaced at the start of each run
+_scheduler = UploadScheduler(10000)
+# whether several stages upload at once, their progress then goes on separate lines
+_shared_progress = False
+
 
 EPOCH = datetime.utcfromtimestamp(0)
 def sort_stagedata(stagedata):
@@ -44,60 +224,259 @@ def sort_stagedata(stagedata):
 	return (date - EPOCH).total_seconds()
 
 
-def _upload_artifact(upload_string, response_upload, getting_video=False, filesize=0):
+class MediaStageStreamUpload(MediaUpload):
+	"""
+	A resumable upload of a stage video that is still being produced. The total size is unknown
+	until FFmpeg finishes, so chunks are handed out as soon as they are written, and the first
+	short chunk tells the API client the upload is complete.
+	"""
+
+	def __init__(self, stream: vbvid.StageStream, chunksize: int, mimetype: str="video/mp4"):
+		self._stream = stream
+		self.chunk_size = chunksize
+		self._mimetype = mimetype
+
+	def chunksize(self):
+		return self.chunk_size
+
+	def mimetype(self):
+		return self._mimetype
+
+	def size(self):
+		return None
+
+	def resumable(self):
+		return True
+
+	def getbytes(self, begin, length):
+		return self._stream.read(begin, length)
+
+	def has_stream(self):
+		return False
+
+
+class SessionExpired(Exception):
+	pass
+
+
+# bytes read from each end of an artifact to fingerprint it, hashing all of a multi-GB video would
+# take as long as slicing it again
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+def _fingerprint(path: Path) -> str:
+	st = os_stat(str(path))
+	h = hashlib.sha256(f"{st.st_size} {st.st_mtime_ns}".encode())
+	with open(str(path), "rb") as f:
+		h.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+		f.seek(max(0, st.st_size - FINGERPRINT_SAMPLE_SIZE))
+		h.update(f.read(FINGERPRINT_SAMPLE_SIZE))
+	return h.hexdigest()
+
+
+def _stage_fingerprint(stagedata: StageData) -> str:
+	# the title, description, and slices all end up in the uploaded video
+	return hashlib.sha256(stagedata.to_json().encode()).hexdigest()
+
+
+@dataclass_json
+@dataclass
+class UploadSession:
+	"""
+	A resumable upload saved alongside its stage, so an interrupted or failed upload can continue
+	from the last byte YouTube committed instead of slicing and uploading the whole video again.
+	"""
+	stage_id: str
+	artifact: str
+	path: str
+	size: int
+	fingerprint: str
+	# sessions saved before the stage was fingerprinted never match, and start over
+	stage_fingerprint: str = ""
+	uri: str = ""
+	offset: int = 0
+
+	@staticmethod
+	def session_path(stagedir: Path, stage_id: str, artifact: str) -> Path:
+		return stagedir / f"{stage_id}.{artifact}.upload"
+
+	@staticmethod
+	def new(stagedir: Path, stagedata: StageData, artifact: str, path: Path) -> 'UploadSession':
+		session = UploadSession(stage_id=stagedata.id, artifact=artifact, path=str(path),
+			size=os_stat(str(path)).st_size, fingerprint=_fingerprint(path),
+			stage_fingerprint=_stage_fingerprint(stagedata))
+		session._stagedir = stagedir
+		return session
+
+	@staticmethod
+	def load(stagedir: Path, stagedata: StageData, artifact: str) -> 'UploadSession':
+		"""
+		Loads a saved session if its artifact is still in the temp directory, and neither it nor the
+		stage it was made from has changed.
+		"""
+		try:
+			with open(UploadSession.session_path(stagedir, stagedata.id, artifact)) as f:
+				session = UploadSession.from_json(f.read())
+			if not session.uri or session.stage_fingerprint != _stage_fingerprint(stagedata):
+				return None
+			if _fingerprint(Path(session.path)) != session.fingerprint:
+				return None
+		except (OSError, ValueError, KeyError):
+			return None
+
+		session._stagedir = stagedir
+		return session
+
+	def save(self) -> None:
+		try:
+			with open(UploadSession.session_path(self._stagedir, self.stage_id, self.artifact), "w") as f:
+				f.write(self.to_json())
+		except OSError as e:
+			cprint(f"#fY#dWARN: Failed to save upload session for stage `{self.stage_id}`, it cannot be resumed. {e}#r")
+
+	def remove(self) -> None:
+		path = UploadSession.session_path(self._stagedir, self.stage_id, self.artifact)
+		if os_exists(path):
+			os_remove(path)
+
+	def track(self, request) -> None:
+		# save as soon as the session exists, the offset is only informational since it is asked
+		# for again when resuming
+		self.offset = request.resumable_progress
+		if request.resumable_uri and request.resumable_uri != self.uri:
+			self.uri = request.resumable_uri
+			self.save()
+
+	def resume(self, request) -> dict:
+		"""
+		Points a new upload request at the saved session, asking YouTube how much it already has.
+		Returns the response of the finished upload if YouTube already had all of it.
+		"""
+		resp, content = request.http.request(self.uri, method="PUT", body="",
+			headers={"Content-Length": "0", "Content-Range": f"bytes */{self.size}"})
+
+		if resp.status in [200, 201]:
+			return json.loads(content)
+		if resp.status != 308:
+			# sessions expire after about a week, or YouTube lost it
+			raise SessionExpired()
+
+		# the range header is missing if nothing was committed yet
+		committed = resp.get("range")
+		request.resumable_uri = self.uri
+		request.resumable_progress = int(committed.split("-")[1]) + 1 if committed else 0
+		self.offset = request.resumable_progress
+		return None
+
+
+def _api_error_reason(err: HttpError) -> str:
+	try:
+		return json.loads(err.content)['error']['errors'][0]['reason']
+	except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+		return ""
+
+
+def _upload_artifact(upload_string, response_upload, request_type, getting_video=False, filesize=0, session=None, sizer=None):
 	video_id = "" # youtube video id
 	resp = None
 	errn = 0
 	errn_max = 10
-
-	uploaded = 0
+	charged = False
+	# plain requests are sent in one go with execute
+	resumable = response_upload.resumable is not None
+
+	uploaded = response_upload.resumable_progress if resumable else 0
+	progress = ProgressReporter(f"#fCUploading {upload_string}:", total_size=filesize, done_size=uploaded,
+		shared=_shared_progress)
+	progress.set(uploaded)
+
+	def handle_limits(err: HttpError) -> bool:
+		# returns true if the error was a quota or rate limit error, which never exits the program
+		reason = _api_error_reason(err)
+		if reason in RATE_LIMIT_ERRORS:
+			secs = _scheduler.backoff()
+			cprint(f"#fY#dWARN: Rate limited by YouTube (`{reason}`), pausing uploads for {secs} seconds...#r")
+			return True
+		if reason in QUOTA_ERRORS:
+			_scheduler.exhaust()
+			cprint(f"#fY#dWARN: YouTube API quota exceeded (`{reason}`), no more uploads will be started.#r")
+			return True
+		return False
 
 	def print_error(f:List, secs:int=5):
 		nonlocal errn, errn_max
+		metrics.count("upload_retries", request=request_type)
+		if sizer is not None:
+			sizer.failed()
 		f = [str(x) for x in f]
 		cprint(f"#fY#dWARN: An HTTP error has occurred ({errn}/{errn_max}), retyring in {secs} seconds... ({', '.join(f)})#r")
 		errn += 1
 		sleep(secs)
 
 	while resp is None:
+		_scheduler.wait()
+		if _scheduler.cancelled:
+			return None
+		if _scheduler.exhausted:
+			cprint(f"#fY#dWARN: Skipping upload of {upload_string}, out of YouTube API quota.#r")
+			return None
+
+		if not charged:
+			_scheduler.charge(request_type)
+			charged = True
+
 		try:
-			status, resp = response_upload.next_chunk()
+			if resumable:
+				before = response_upload.resumable_progress
+				start = monotonic()
+				status, resp = response_upload.next_chunk()
+				elapsed = monotonic() - start
+				metrics.observe("upload_chunk_seconds", elapsed, request=request_type)
+				if status and sizer is not None:
+					sizer.measure(status.resumable_progress - before, elapsed)
+			else:
+				start = monotonic()
+				status, resp = None, response_upload.execute(num_retries=0)
+				metrics.observe("upload_chunk_seconds", monotonic() - start, request=request_type)
+			_scheduler.succeeded()
+			if session is not None:
+				session.track(response_upload)
 
-			progress = status.progress()*100 if status else 100
 			uploaded = status.resumable_progress if status else uploaded
-			# filesize = status.total_size if status else filesize
-			if not status:
+			if not status and filesize is not None:
 				uploaded = filesize
-			
-			su = format_size(uploaded, units=False)
-			st = format_size(filesize)
-			sp = f"#d({su}/{st})...#r"
-			cprint(f"#c#fCUploading {upload_string}: #fC{progress:.1f}#fY%#r {sp}", end='\r')
+			progress.set(uploaded)
 
 			if resp is not None and getting_video:
 				video_id = resp["id"]
 		except ResumableUploadError as err:
+			if err.resp.status in [403, 429] and handle_limits(err):
+				continue
 			if err.resp.status in [400, 401, 402, 403]:
 				try:
 					jsondata = json.loads(err.content)['error']['errors'][0]
-					exit_prog(40, f"API Error: `{jsondata['reason']}`. Message: `{jsondata['message']}`")
-				except (json.JSONDecodeError, KeyError):
-					exit_prog(40, f"Unknown API Error has occured, ({err.resp.status}, {err.content})")
+					errmsg = f"API Error: `{jsondata['reason']}`. Message: `{jsondata['message']}`"
+				except (json.JSONDecodeError, KeyError, IndexError, TypeError):
+					errmsg = f"Unknown API Error has occured, ({err.resp.status}, {err.content})"
+				raise UploadFatal(errmsg)
 			print_error([err.resp.status, err.content])
 		except HttpError as err:
+			if err.resp.status in [403, 429] and handle_limits(err):
+				continue
 			if err.resp.status in [500, 502, 503, 504]:
 				print_error([err.resp.status, err.content])
 			else:
-				exit_prog(40, f"Unknown API Error has occured, ({err.resp.status}, {err.content})")
+				raise UploadFatal(f"Unknown API Error has occured, ({err.resp.status}, {err.content})")
 		except RETRIABLE_EXCEPTS as err:
 			print_error([err])
 
 		if errn >= errn_max:
 			cprint("#fY#dWARN: Skipping upload, errored too many times.#r")
+			if session is not None and session.uri:
+				session.save()
+				cprint("#fY#dThe upload session has been saved, and will be resumed next upload.#r")
 			return None
 	
-	# extra newline when done
-	print()
+	# final progress and an extra newline when done
+	progress.finish()
 	
 	if getting_video:
 		return video_id
@@ -105,19 +484,8 @@ def _upload_artifact(upload_string, response_upload, getting_video=False, filesi
 		return True
 
 
-def upload_video(conf: Config, service: Resource, stagedata: StageData) -> str:
-	tmpfile = None
-	try:
-		tmpfile = vbvid.process_stage(conf, stagedata)
-	except vbvid.FailedToSlice as e:
-		cprint(f"#r#fRSkipping stage `{stagedata.id}`, failed to slice video with ID of `{e.vid}`.#r\n")
-	except vbvid.FailedToConcat:
-		cprint(f"#r#fRSkipping stage `{stagedata.id}`, failed to concatenate videos.#r\n")
-	except vbvid.FailedToCleanUp as e:
-		cprint(f"#r#fRSkipping stage `{stagedata.id}`, failed to clean up temp files.#r\n\n{e.vid}")
-
-	# send request to youtube to upload
-	request_body = {
+def _video_request_body(stagedata: StageData) -> dict:
+	return {
 		"snippet": {
 			"categoryId": 20,
 			"title": stagedata.title,
@@ -129,8 +497,68 @@ def upload_video(conf: Config, service: Resource, stagedata: StageData) -> str:
 		}
 	}
 
+
+def upload_video_pipelined(conf: Config, service: Resource, stagedata: StageData) -> str:
+	# upload the video while it is still being sliced, so the whole thing takes about as long as
+	# the slower of the two instead of both
+	stream = vbvid.StageStream(conf, stagedata)
+	media_file = MediaStageStreamUpload(stream, conf.upload.chunk_size)
+	sizer = ChunkSizer.from_conf(conf, media_file)
+
+	response_upload = service.videos().insert(
+		part="snippet,status",
+		body=_video_request_body(stagedata),
+		notifySubscribers=conf.upload.notify_subscribers,
+		media_body=media_file
+	)
+
+	uploaded = None
+	try:
+		uploaded = _upload_artifact(f"stage video #r`#fM{stagedata.id}#r`", response_upload, "videos.insert", getting_video=True, filesize=None, sizer=sizer)
+	except vbvid.FailedToSlice as e:
+		cprint(f"\n#r#fRSkipping stage `{stagedata.id}`, failed to slice video(s) for stage `{e.video_id}`.#r\n")
+
+	try:
+		del media_file
+		del response_upload
+		stream.close()
+	except Exception as e:
+		exit_prog(90, f"Failed to remove temp video stream files of stage `{stagedata.id}` after upload. {e}")
+
+	return uploaded
+
+
+def upload_video(conf: Config, service: Resource, stagedata: StageData) -> str:
+	if conf.upload.pipelined:
+		return upload_video_pipelined(conf, service, stagedata)
+
+	STAGE_DIR = conf.directories.stage
+
+	# pick up where a previous upload left off, if its sliced video is still around
+	session = UploadSession.load(STAGE_DIR, stagedata, "video")
+	tmpfile = None
+	if session is not None:
+		tmpfile = Path(session.path)
+		cprint(f"#dFound an unfinished upload for stage `{stagedata.id}`, resuming...#r")
+	else:
+		try:
+			tmpfile = vbvid.process_stage(conf, stagedata)
+		except vbvid.FailedToSlice as e:
+			cprint(f"#r#fRSkipping stage `{stagedata.id}`, failed to slice video with ID of `{e.video_id}`.#r\n")
+			return None
+		except vbvid.FailedToConcat:
+			cprint(f"#r#fRSkipping stage `{stagedata.id}`, failed to concatenate videos.#r\n")
+			return None
+		except vbvid.FailedToCleanUp as e:
+			cprint(f"#r#fRSkipping stage `{stagedata.id}`, failed to clean up temp files.#r\n\n{e.video_id}")
+			return None
+
+	# send request to youtube to upload
+	request_body = _video_request_body(stagedata)
+
 	# create media file, upload in chunks
-	media_file = MediaFileUpload(str(tmpfile), chunksize=conf.upload.chunk_size, resumable=True)
+	media_file = _media_file(conf, tmpfile, resumable=True)
+	sizer = ChunkSizer.from_conf(conf, media_file)
 
 	# create upload request and execute
 	response_upload = service.videos().insert(
@@ -142,14 +570,34 @@ def upload_video(conf: Config, service: Resource, stagedata: StageData) -> str:
 
 	filesize = media_file.size()
 
-	cprint(f"#c#fCUploading stage video #r`#fM{stagedata.id}#r`: #fC0#fY%#r #d(0/{format_size(filesize)})...#r", end="\r")
-	uploaded = _upload_artifact(f"stage video #r`#fM{stagedata.id}#r`", response_upload, getting_video=True, filesize=filesize)
+	uploaded = None
+	if session is not None:
+		try:
+			finished = session.resume(response_upload)
+			if finished is not None:
+				uploaded = finished["id"]
+		except (SessionExpired, HttpError, KeyError, ValueError) + RETRIABLE_EXCEPTS:
+			cprint(f"#fY#dWARN: Could not resume upload of stage `{stagedata.id}`, starting over.#r")
+			session.remove()
+			session = None
+
+	if session is None:
+		session = UploadSession.new(STAGE_DIR, stagedata, "video", tmpfile)
+
+	if uploaded is None:
+		uploaded = _upload_artifact(f"stage video #r`#fM{stagedata.id}#r`", response_upload, "videos.insert",
+			getting_video=True, filesize=filesize, session=session, sizer=sizer)
+
+	# keep the video around so the saved session can resume with it
+	if uploaded is None and session.uri:
+		return None
 
 	try:
 		# delete vars to release the files
 		del media_file
 		del response_upload
 		# sleep(1)
+		session.remove()
 		os_remove(str(tmpfile))
 	except Exception as e:
 		exit_prog(90, f"Failed to remove temp video slice file of stage `{stagedata.id}` after upload. {e}")
@@ -171,7 +619,8 @@ def upload_captions(conf: Config, service: Resource, stagedata: StageData, vid_i
 		}
 	}
 
-	media_file = MediaFileUpload(str(tmpfile), chunksize=conf.upload.chunk_size, resumable=True)
+	media_file = _media_file(conf, tmpfile)
+	sizer = ChunkSizer.from_conf(conf, media_file) if media_file.resumable() else None
 
 	response_upload = service.captions().insert(
 		part="snippet",
@@ -182,8 +631,7 @@ def upload_captions(conf: Config, service: Resource, stagedata: StageData, vid_i
 
 	filesize = media_file.size()
 
-	cprint(f"#c#fCUploading stage chatlog #r`#fM{stagedata.id}#r`: #fC0#fY%#r #d(0/{format_size(filesize)})...#r", end="\r")
-	uploaded = _upload_artifact(f"stage chatlog #r`#fM{stagedata.id}#r`", response_upload, filesize=filesize)
+	uploaded = _upload_artifact(f"stage chatlog #r`#fM{stagedata.id}#r`", response_upload, "captions.insert", filesize=filesize, sizer=sizer)
 	
 	try:
 		# delete vars to release the files
@@ -209,9 +657,10 @@ def upload_thumbnail(conf: Config, service: Resource, stagedata: StageData, vid_
 	if not tmpfile:
 		return False
 
-	media_file = MediaFileUpload(str(tmpfile), chunksize=conf.upload.chunk_size, resumable=True)
+	media_file = _media_file(conf, tmpfile)
+	sizer = ChunkSizer.from_conf(conf, media_file) if media_file.resumable() else None
 
-	# this may need to be a straight upload, not resumable
+	# thumbnails are at most 2MB, so this is a straight upload
 	# see: https://developers.google.com/youtube/v3/docs/thumbnails/set
 	response_upload = service.thumbnails().set(
 		videoId=vid_id,
@@ -220,8 +669,7 @@ def upload_thumbnail(conf: Config, service: Resource, stagedata: StageData, vid_
 
 	filesize = media_file.size()
 
-	cprint(f"#c#fCUploading stage thumbnail #r`#fM{stagedata.id}#r`: #fC0#fY%#r #d(0/{format_size(filesize)})...#r", end="\r")
-	uploaded = _upload_artifact(f"stage thumbnail #r`#fM{stagedata.id}#r`", response_upload, filesize=filesize)
+	uploaded = _upload_artifact(f"stage thumbnail #r`#fM{stagedata.id}#r`", response_upload, "thumbnails.set", filesize=filesize, sizer=sizer)
 
 	try:
 		# delete vars to release the files
@@ -235,6 +683,65 @@ def upload_thumbnail(conf: Config, service: Resource, stagedata: StageData, vid_
 	return uploaded
 
 
+def _stage_request_types(conf: Config) -> List[str]:
+	request_types = ["videos.insert"]
+	if conf.upload.thumbnail_enable:
+		request_types.append("thumbnails.set")
+	if conf.upload.chat_enable:
+		request_types.append("captions.insert")
+	return request_types
+
+
+_cache_lock = Lock()
+def upload_stage(conf: Config, service: Resource, stage: StageData, cache, total: int) -> bool:
+	STAGE_DIR = conf.directories.stage
+
+	request_types = _stage_request_types(conf)
+	if not _scheduler.reserve(request_types):
+		t = f"Not enough YouTube API quota left to upload stage `{stage.id}`."
+		cprint(f"#fY#dWARN: {t} Skipping...#r")
+		send_upload_error(t)
+		return False
+
+	try:
+		video_id = upload_video(conf, service, stage)
+	
+		if video_id is None:
+			send_upload_error(f"Failed to upload stage `{stage.id}`.")
+			return False
+
+		if conf.upload.thumbnail_enable:
+			if not upload_thumbnail(conf, service, stage, video_id):
+				t = f"Failed to upload video thumbnail for stage `{stage.id}`, video ID `{video_id}`."
+				cprint(f"#fY#dWARN: {t} Skipping...#r")
+				send_upload_error(t)
+
+		if conf.upload.chat_enable:
+			if not upload_captions(conf, service, stage, video_id):
+				t = f"Failed to upload chat captions for stage `{stage.id}`, video ID `{video_id}`."
+				cprint(f"#fY#dWARN: {t} Skipping...#r")
+				send_upload_error(t)
+		
+		cprint(f"#l#fGVideo was successfully uploaded!#r #dhttps://youtu.be/{video_id}#r")
+		
+		if conf.stage.delete_on_upload:
+			try:
+				os_remove(STAGE_DIR / f"{stage.id}.stage")
+				with _cache_lock:
+					cache.stages.remove(stage.id)
+					save_cache(conf, cache)
+			except:
+				send_upload_error(f"Failed to remove stage `{stage.id}` after upload.")
+				if total < 1:
+					exit_prog(90, f"Failed to remove stage `{stage.id}` after upload.")
+				else:
+					cprint(f"#fR#lFailed to remove stage `{stage.id}` after upload.#r")
+		send_upload_video(stage, f"https://youtu.be/{video_id}")
+		return True
+	finally:
+		_scheduler.release(request_types)
+
+
 def _download_credentials(conf: Config) -> None:
 	CLIENT_FILE = conf.upload.client_path
 	CLIENT_FILE_URL = conf.upload.client_url
@@ -289,10 +796,13 @@ def get_credentials(conf:Config, SCOPES:List[str]) -> Credentials:
 	return creds
 
 def run(args):
+	global _scheduler, _shared_progress
+
 	# load config
 	conf = load_conf(args.config)
 	cache = load_cache(conf, args.cache_toggle)
 	init_webhooks(conf)
+	metrics.init_metrics(conf, "upload")
 
 	# configure variables
 	STAGE_DIR = conf.directories.stage
@@ -357,41 +867,46 @@ def run(args):
 	cprint("done.#r")
 	
 	# begin to upload
+	_scheduler = UploadScheduler(conf.upload.daily_quota)
+	workers = min(conf.upload.max_concurrent_uploads, len(stagedatas))
+	_shared_progress = workers > 1
 	finished_jobs = 0
 	cprint(f"#dAbout to upload {len(stagedatas)} stage(s).#r")
-  
-	for stage in stagedatas:
-		video_id = upload_video(conf, service, stage)
-		if video_id is not None:
-			if conf.upload.thumbnail_enable:
-				if not upload_thumbnail(conf, service, stage, video_id):
-					t = f"Failed to upload video thumbnail for stage `{stage.id}`, video ID `{video_id}`."
-					cprint(f"#fY#dWARN: {t} Skipping...#r")
-					send_upload_error(t)
-
-			if conf.upload.chat_enable:
-				if not upload_captions(conf, service, stage, video_id):
-					t = f"Failed to upload chat captions for stage `{stage.id}`, video ID `{video_id}`."
-					cprint(f"#fY#dWARN: {t} Skipping...#r")
-					send_upload_error(t)
-			
-			cprint(f"#l#fGVideo was successfully uploaded!#r #dhttps://youtu.be/{video_id}#r")
-			
-			if conf.stage.delete_on_upload:
-				try:
-					os_remove(STAGE_DIR / f"{stage.id}.stage")
-					cache.stages.remove(stage.id)
-					save_cache(conf, cache)
-				except:
-					send_upload_error(f"Failed to remove stage `{stage.id}` after upload.")
-					if len(stagedatas) < 1:
-						exit_prog(90, f"Failed to remove stage `{stage.id}` after upload.")
-					else:
-						cprint(f"#fR#lFailed to remove stage `{stage.id}` after upload.#r")
-			finished_jobs += 1
-			send_upload_video(stage, f"https://youtu.be/{video_id}")
-		else:
-			send_upload_error(f"Failed to upload stage `{stage.id}`.")
+
+	if workers <= 1:
+		try:
+			for stage in stagedatas:
+				finished_jobs += upload_stage(conf, service, stage, cache, len(stagedatas))
+		except UploadFatal as e:
+			exit_prog(40, str(e))
+	else:
+		# each thread needs its own service, the underlying HTTP client isn't thread safe
+		threadlocal = local()
+		def upload_stage_threaded(stage: StageData) -> bool:
+			if getattr(threadlocal, "service", None) is None:
+				threadlocal.service = build(API_NAME, API_VERSION, credentials=creds)
+			return upload_stage(conf, threadlocal.service, stage, cache, len(stagedatas))
+
+		cprint(f"#dUploading up to {workers} stages at once.#r")
+		executor = ThreadPoolExecutor(max_workers=workers)
+		futures = []
+		try:
+			futures = [executor.submit(upload_stage_threaded, stage) for stage in stagedatas]
+			# the first stage to fail for good stops the rest, exiting from a worker thread wouldn't
+			for future in as_completed(futures):
+				finished_jobs += future.result()
+		except (KeyboardInterrupt, UploadFatal, SystemExit) as e:
+			_scheduler.cancelled = True
+			# stages that haven't started never will, the running ones stop at their next chunk
+			for future in futures:
+				future.cancel()
+			executor.shutdown(wait=True)
+			if isinstance(e, UploadFatal):
+				exit_prog(40, str(e))
+			raise
+		executor.shutdown()
+
+	cprint(f"#d{_scheduler.report()}.#r")
 	
 	if len(stagedatas) > 1:
 		send_upload_job_done(finished_jobs, len(stagedatas))
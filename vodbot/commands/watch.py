@@ -0,0 +1,131 @@
+# Watch, keeps pulling VODs and Clips from Twitch.tv as they're published
+
+from . import pull
+from vodbot import journal, metrics, twitch
+from vodbot.cache import Cache, save_cache
+from vodbot.itd import download as itd_dl, worker as itd_work
+from vodbot.itd.gql import GQLException, GQLItemError
+from vodbot.printer import cprint
+from vodbot.webhook import send_pull_error, send_pull_job_done
+
+from datetime import datetime, timedelta
+from random import uniform
+from time import monotonic, sleep
+from typing import Dict
+
+from requests.exceptions import RequestException
+
+
+# VODs published this long before the newest pulled one are still listed, in case they were still
+# being recorded when it was pulled. Twitch ends streams after 48 hours.
+VOD_LOOKBACK = timedelta(hours=48)
+# How far back Clips are listed after the first poll, by the shortest period covering the interval.
+CLIP_PERIODS = [
+	(timedelta(days=1), "LAST_DAY"),
+	(timedelta(days=7), "LAST_WEEK"),
+	(timedelta(days=30), "LAST_MONTH"),
+]
+
+
+def clip_period(interval: float) -> str:
+	for period, name in CLIP_PERIODS:
+		if timedelta(seconds=interval) < period:
+			return name
+	return "ALL_TIME"
+
+
+def newest_vod(cache: Cache, login: str) -> str:
+	"""
+	Returns the publish timestamp of the newest pulled VOD of a channel, or None if there are none.
+	"""
+	metas = cache.channels[login].vods.values()
+	if not metas:
+		return None
+	# meta names are "{created_at}_{id}.meta", with colons swapped for semicolons
+	return max(metas).split("_")[0].replace(";", ":")
+
+
+def vod_cursor(newest: str) -> str:
+	if newest is None:
+		return None
+	since = datetime.strptime(newest[:19], "%Y-%m-%dT%H:%M:%S") - VOD_LOOKBACK
+	return since.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def next_poll(interval: float, jitter: float) -> float:
+	return monotonic() + interval * (1 + uniform(-jitter, jitter))
+
+
+def pull_live(conf, channel: twitch.Channel, live: Dict[str, int]) -> None:
+	"""
+	Pulls the segments appended to a channel's VODs that are still being recorded since the last
+	poll. `live` keeps how many segments of each were pulled, and forgets the VODs that are done.
+	"""
+	for vod in channel.live_vods:
+		cprint(f"Pulling live #fMVOD#r `#fM{vod.id}#r` of #fY#l{channel.display_name}#r...")
+		try:
+			live[vod.id] = itd_dl.dl_video_segments(conf, vod, live.get(vod.id, 0))
+		except (itd_work.DownloadFailed, itd_work.TwitchAccessDenied):
+			cprint(f"#fY#dWARN: Failed to pull segments of live VOD `{vod.id}`, trying again next interval.#r")
+		except (GQLException, GQLItemError, RequestException) as e:
+			# one VOD's playlist failing, sub-only ones included, shouldn't stop the rest of the channel
+			print(flush=True)
+			cprint(f"#fY#dWARN: Failed to get playlist of live VOD `{vod.id}`, trying again next interval. {e}#r")
+
+	# VODs that are done get joined by the regular pull, from the segments already in the temp folder
+	for vod_id in set(live) - {vod.id for vod in channel.live_vods}:
+		del live[vod_id]
+
+
+def poll(conf, cache: Cache, channel: twitch.Channel, pull_type: str, since: str, period: str,
+	live: Dict[str, int]) -> None:
+	newvods, newclips = pull.list_channel(conf, cache, channel, pull_type, since=since, clip_period=period,
+		live=conf.pull.archive_live)
+	pull_live(conf, channel, live)
+	if newvods + newclips == 0:
+		return
+
+	cprint(f"Pulling videos for #fY#l{channel.display_name}#r...")
+	fin_vods, fin_clips = pull.pull_channel(conf, cache, channel)
+	save_cache(conf, cache)
+	journal.clear_journal()
+	send_pull_job_done(fin_vods, fin_clips, newvods, newclips)
+
+
+def run(args):
+	conf, cache, channels = pull.setup(args, "watch")
+	pull.resume(conf, cache, channels)
+	cprint(f"#r#dWatching {len(channels)} channel(s) every {args.interval} seconds...#r", flush=True)
+
+	# every channel is fully listed on its first poll, then only the newest of it after that
+	cursors: Dict[str, str] = {}
+	# segments pulled of each VOD still being recorded, by channel
+	live: Dict[str, Dict[str, int]] = {channel.login: {} for channel in channels}
+	polled = set()
+	due = {channel.login: monotonic() for channel in channels}
+	flushed = monotonic()
+
+	while channels:
+		channel = min(channels, key=lambda c: due[c.login])
+		wait = due[channel.login] - monotonic()
+		if wait > 0:
+			sleep(wait)
+
+		first = channel.login not in polled
+		since = None if first else vod_cursor(cursors.get(channel.login))
+		period = "ALL_TIME" if first else clip_period(args.interval)
+
+		try:
+			poll(conf, cache, channel, args.type, since, period, live[channel.login])
+			polled.add(channel.login)
+		except (GQLException, GQLItemError, RequestException) as e:
+			print(flush=True)
+			cprint(f"#fY#dWARN: Failed to poll channel `{channel.login}`, trying again next interval. {e}#r")
+			send_pull_error(f'Failed to poll channel "{channel.login}" for new videos. {e}', f"https://twitch.tv/{channel.login}")
+
+		# once a cycle, not after every channel, the report only grows by what changed
+		if monotonic() - flushed >= args.interval:
+			metrics.flush_metrics()
+			flushed = monotonic()
+		cursors[channel.login] = newest_vod(cache, channel.login)
+		due[channel.login] = next_poll(args.interval, args.jitter)
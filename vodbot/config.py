@@ -4,13 +4,11 @@
 from dataclasses import dataclass, field
 from dataclasses_json import dataclass_json, config
 from marshmallow import fields, validate, ValidationError
-from typing import Dict, List, Any, Mapping
+from typing import Dict, List, Any, Mapping, Optional
 from pathlib import Path
 from os import cpu_count
 
-
-DEFAULT_CONFIG_DIRECTORY = Path.home() / ".vodbot"
-DEFAULT_CONFIG_PATH = DEFAULT_CONFIG_DIRECTORY / "config.json"
+from .fastload import DEFAULT_CONFIG_DIRECTORY, DEFAULT_CONFIG_PATH
 
 
 class _MMPath(fields.Field):
@@ -26,6 +24,31 @@ class _MMPath(fields.Field):
 _path_field_config = config(encoder=lambda x: str(x), decoder=lambda x: Path(x), mm_field=_MMPath())
 
 
+@dataclass_json
+@dataclass
+class _ConfigQuality:
+	# Tallest video to pull in pixels, such as 720. Defaults to 0, no limit.
+	max_height: int = field(default=0, metadata=config(mm_field=fields.Int(validate=validate.Range(0))))
+	# Highest bitrate of video to pull in bits per second. Defaults to 0, no limit.
+	max_bitrate: int = field(default=0, metadata=config(mm_field=fields.Int(validate=validate.Range(0))))
+	# Preferred video codec, "av1" or "h264", used when the VOD is available in it. Defaults to "",
+	# no preference. With no limits or preference set, source quality is always pulled.
+	codec: str = field(default="", metadata=config(mm_field=fields.Str(
+		validate=validate.OneOf(["", "av1", "h264"]))))
+
+@dataclass_json
+@dataclass
+class _ConfigBandwidthLimit:
+	# Local time of day this limit starts at, like "08:00". Windows ending at or before their start
+	# run past midnight.
+	start: str = field(metadata=config(mm_field=fields.Str(
+		validate=validate.Regexp(r"^([01]\d|2[0-3]):[0-5]\d$"))))
+	# Local time of day this limit ends at, like "20:00".
+	end: str = field(metadata=config(mm_field=fields.Str(
+		validate=validate.Regexp(r"^([01]\d|2[0-3]):[0-5]\d$"))))
+	# Bytes per second all downloads together are kept under during this window, 0 for no limit.
+	rate: int = field(default=0, metadata=config(mm_field=fields.Int(validate=validate.Range(0))))
+
 @dataclass_json
 @dataclass
 class _ConfigChannel:
@@ -38,6 +61,8 @@ class _ConfigChannel:
 	save_clips: bool = True
 	# Toggle for saving chat logs from VOD videos.
 	save_chat: bool = True
+	# Quality of VOD videos to pull from this channel, replacing the quality in the pull config.
+	quality: Optional[_ConfigQuality] = None
 
 @dataclass_json
 @dataclass
@@ -61,18 +86,49 @@ class _ConfigPull:
 	# many, many hours on issues rooted with this client ID. You have been warned!!!
 	gql_client: str = "kd1unb4b3q4t58fwlpcbzcbnm76a8fp"
 
+	# Quality of VOD videos to pull, for every channel that doesn't set its own. Defaults to source.
+	quality: _ConfigQuality = field(default_factory=lambda: _ConfigQuality())
+
 	# Number of threads that can concurrently work to download files from Twitch.
 	# Defaults to the number of cores on the machine (or 1 in cases where that can't be measured).
 	max_workers: int = field(default=cpu_count() or 1, metadata=config(mm_field=fields.Int(validate=validate.Range(1))))
-	# Number of bytes to stream-write to temporary video files at a time.
-	# Defaults to 1024 bytes.
-	chunk_size: int = field(default=1024, metadata=config(mm_field=fields.Int(validate=validate.Range(1024))))
+	# Number of bytes to read from the connection and write to temporary video files at a time, at
+	# least 65536 bytes are always used. Defaults to 1048576 bytes (1 MiB).
+	chunk_size: int = field(default=1048576, metadata=config(mm_field=fields.Int(validate=validate.Range(1024))))
 	# How many times the download connection should be retried before giving up.
 	# Defaults to 5 retries.
 	connection_retries: int = field(default=5, metadata=config(mm_field=fields.Int(validate=validate.Range(1))))
 	# Seconds before the download connection should time out and should be tried again.
 	# Defaults to 5 seconds.
 	connection_timeout: float = field(default=5, metadata=config(mm_field=fields.Float(validate=validate.Range(1))))
+	# Toggle for checking that each downloaded VOD segment lasts as long as the playlist says it
+	# should, by reading the timestamps at its start and end. Segments are always checked for their
+	# full size and for MPEG-TS packet sync bytes. Defaults to false.
+	verify_segment_duration: bool = False
+	# Bytes per second all downloads together (VOD segments, Clips, and chat) are kept under, shared
+	# fairly between download threads. Defaults to 0, no limit.
+	bandwidth_limit: int = field(default=0, metadata=config(mm_field=fields.Int(validate=validate.Range(0))))
+	# Limits for certain times of day, like a lower one during work hours, replacing the one above
+	# while they last. The first window the time is in is used. Defaults to no windows.
+	bandwidth_schedule: List[_ConfigBandwidthLimit] = field(default_factory=lambda: [])
+	# Toggle for pulling the segments of streams that are still live when watching channels, the
+	# new ones on each check instead of all at once after the stream ends. The VOD is joined once
+	# Twitch marks it as done. Only used by `vodbot watch`. Defaults to false.
+	archive_live: bool = False
+	# Toggle for cutting Clips out of VODs that were already pulled instead of downloading them,
+	# copying the streams without re-encoding. Cuts land on keyframes, so these Clips may start a
+	# couple seconds early. Clips whose VOD wasn't pulled, or is muted where the Clip is, are still
+	# downloaded. Defaults to false.
+	clips_from_vods: bool = False
+	# Where VODs are joined once their segments, which always go to the temp directory, are pulled.
+	# "local" always joins in the temp directory, then renames the VOD into place if both
+	# directories are on the same filesystem, or copies it over in large sequential writes if not,
+	# which suits network mounts. "auto" does the same, except it joins straight into the VODs
+	# directory when a copy would be needed and the temp directory lacks room for a second copy of
+	# the VOD next to its segments. "direct" always joins straight into the VODs directory.
+	# Defaults to "auto".
+	join_placement: str = field(default="auto", metadata=config(mm_field=fields.Str(
+		validate=validate.OneOf(["auto", "local", "direct"]))))
 
 	# Below is some flags and info for using the official V5 API over the private GQL API where
 	# possible. Currently not implemented in any form and does not affect anything. This would
@@ -171,6 +227,21 @@ class _ConfigUpload:
 	# Size of chunks of uploaded data in bytes, with a minimum of 262144. It's recommended that this
 	# size be a multiple of this minimum value.
 	chunk_size: int = field(default=262144, metadata=config(mm_field=fields.Int(validate=validate.Range(262144))))
+	# Toggle for growing and shrinking upload chunks to match the measured speed and latency of the
+	# connection, starting from `chunk_size` above. Chunks are always a multiple of 262144 bytes.
+	adaptive_chunk_size: bool = True
+	# Largest size of an adapted upload chunk in bytes. Defaults to 64 MiB.
+	max_chunk_size: int = field(default=67108864, metadata=config(mm_field=fields.Int(validate=validate.Range(262144))))
+	# Toggle for uploading the stage video while FFmpeg is still producing it, instead of waiting for
+	# the whole video to be written first. The video is uploaded as fragmented MP4. Pipelined uploads
+	# aren't saved to be resumed, an interrupted one starts over from the beginning on the next run.
+	pipelined: bool = False
+	# Number of stages that can be uploaded at the same time. Each stage still uploads its video,
+	# thumbnail, and captions in order. Defaults to 1, one stage at a time.
+	max_concurrent_uploads: int = field(default=1, metadata=config(mm_field=fields.Int(validate=validate.Range(1))))
+	# Number of YouTube Data API quota units available for a run. Stages are not started if what's
+	# left can't cover their video, thumbnail, and captions. Defaults to 10000, YouTube's daily quota.
+	daily_quota: int = field(default=10000, metadata=config(mm_field=fields.Int(validate=validate.Range(0))))
 	# Port for the OAuth local server to run on, used for logging into Google's services.
 	oauth_port: int = field(default=8080, metadata=config(mm_field=fields.Int(validate=validate.Range(0, 65535))))
 	# Toggle for if uploaded videos should be pushed to subscription feeds and notify users of new
@@ -286,6 +357,17 @@ class _ConfigWebhooks:
 	username: str = "VodBot Webhook"
 	url: str = ""
 
+@dataclass_json
+@dataclass
+class _ConfigMetrics:
+	# Toggle for recording how long GQL requests, segment downloads, FFmpeg, and upload chunks take.
+	enable: bool = False
+	# Path of the JSON lines report, a summary of each run is appended to it when VodBot exits.
+	report_path: Path = field(default=DEFAULT_CONFIG_DIRECTORY/"metrics.jsonl", metadata=_path_field_config)
+	# Path of a Prometheus textfile to write the same summary to, for node_exporter's textfile
+	# collector. If no path is specified, no textfile is written.
+	prometheus_path: Path = field(default=Path(), metadata=_path_field_config)
+
 @dataclass_json
 @dataclass
 class _ConfigDirectories:
@@ -316,7 +398,23 @@ class Config:
 	upload: _ConfigUpload =           field(default_factory=lambda: _ConfigUpload())
 	thumbnail: _ConfigThumbnail =     field(default_factory=lambda: _ConfigThumbnail())
 	webhooks: _ConfigWebhooks =       field(default_factory=lambda: _ConfigWebhooks())
+	metrics: _ConfigMetrics =         field(default_factory=lambda: _ConfigMetrics())
 	directories: _ConfigDirectories = field(default_factory=lambda: _ConfigDirectories())
 
 
-DEFAULT_CONFIG_SCHEMA = Config.schema()
+# Building the marshmallow schema for the whole config tree is slow, so it's only done when a config
+# actually needs validating. `DEFAULT_CONFIG_SCHEMA` is still available as a module attribute.
+_config_schema = None
+def get_config_schema():
+	global _config_schema
+
+	if _config_schema is None:
+		_config_schema = Config.schema()
+
+	return _config_schema
+
+
+def __getattr__(name):
+	if name == "DEFAULT_CONFIG_SCHEMA":
+		return get_config_schema()
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
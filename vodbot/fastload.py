@@ -0,0 +1,50 @@
+# Module to quickly read the few parts of the config and cache that shell completion and light
+# commands need. Only the standard library is used, so none of the schema validation is done here,
+# anything that fails to load should fall back to the full loaders in util and cache.
+
+import json
+from pathlib import Path
+from typing import Dict, List
+
+
+DEFAULT_CONFIG_DIRECTORY = Path.home() / ".vodbot"
+DEFAULT_CONFIG_PATH = DEFAULT_CONFIG_DIRECTORY / "config.json"
+DEFAULT_DIRECTORIES = {
+	name: DEFAULT_CONFIG_DIRECTORY / name
+		for name in ["vods", "clips", "temp", "stage", "thumbnail"]
+}
+
+
+def load_raw_conf(filename) -> dict:
+	"""
+	Loads a VodBot JSON configuration file as plain JSON, without validating it.
+	"""
+	with open(filename) as f:
+		return json.load(f)
+
+
+def get_directories(raw_conf: dict) -> Dict[str, Path]:
+	directories = dict(DEFAULT_DIRECTORIES)
+	for name, path in raw_conf.get("directories", {}).items():
+		if name in directories:
+			directories[name] = Path(path)
+
+	return directories
+
+
+def get_channel_logins(raw_conf: dict) -> List[str]:
+	return [channel["username"] for channel in raw_conf.get("channels", [])]
+
+
+def load_raw_cache(directories: Dict[str, Path]) -> dict:
+	"""
+	Loads the cache JSON file as plain JSON. Unlike `cache.load_cache`, a missing cache is not
+	created here.
+	"""
+	with open(directories["temp"] / "cache.json") as f:
+		return json.load(f)
+
+
+def load_raw_stage(stagedir: Path, sid: str) -> dict:
+	with open(stagedir / f"{sid}.stage") as f:
+		return json.load(f)
@@ -0,0 +1,101 @@
+# Module to keep every download VodBot makes under one shared bandwidth limit, which can change with
+# the time of day. Downloads take their share of the limit in small slices, first come first served,
+# so no thread waits behind another for longer than it takes to read one slice.
+
+from vodbot import metrics
+from vodbot.config import Config, _ConfigBandwidthLimit
+
+from datetime import datetime
+from threading import Lock
+from time import monotonic, sleep
+from typing import List
+
+
+# Seconds worth of the limit that can be read ahead, smoothing over threads waking up late.
+BURST_SECONDS = 0.25
+# Seconds worth of the limit read at a time by each download while limited.
+SLICE_SECONDS = 0.05
+MIN_SLICE_SIZE = 16 * 1024
+# Seconds between checks of the schedule for which limit applies.
+SCHEDULE_INTERVAL = 30.0
+
+_lock = Lock()
+_default_rate = 0
+_schedule: List[_ConfigBandwidthLimit] = []
+_rate = 0
+_rate_checked = None
+# monotonic time until which the limit is already handed out
+_reserved_until = 0.0
+
+
+def init_bandwidth(conf: Config):
+	global _default_rate, _schedule, _rate, _rate_checked
+
+	_default_rate = conf.pull.bandwidth_limit
+	_schedule = conf.pull.bandwidth_schedule
+	_rate = _default_rate
+	_rate_checked = None
+
+
+def _minutes(time: str) -> int:
+	hours, minutes = time.split(":")
+	return int(hours) * 60 + int(minutes)
+
+
+def scheduled_rate(now: datetime) -> int:
+	"""
+	Returns the limit in bytes per second for a local time, 0 for none.
+	"""
+	minute = now.hour * 60 + now.minute
+	for window in _schedule:
+		start, end = _minutes(window.start), _minutes(window.end)
+		if start < end and start <= minute < end:
+			return window.rate
+		if start >= end and (minute >= start or minute < end):
+			return window.rate
+	return _default_rate
+
+
+def current_rate() -> int:
+	global _rate, _rate_checked
+
+	if not _schedule:
+		return _default_rate
+
+	now = monotonic()
+	if _rate_checked is None or now - _rate_checked >= SCHEDULE_INTERVAL:
+		_rate = scheduled_rate(datetime.now())
+		_rate_checked = now
+	return _rate
+
+
+def read_size(size: int) -> int:
+	"""
+	Returns how many bytes a download should read at a time, keeping reads small while limited so
+	threads take turns.
+	"""
+	rate = current_rate()
+	if not rate:
+		return size
+	return min(size, max(MIN_SLICE_SIZE, int(rate * SLICE_SECONDS)))
+
+
+def consume(size: int):
+	"""
+	Counts bytes that were just read against the limit, sleeping for as long as it takes the limit
+	to catch up with them. Threads are served in the order they got here.
+	"""
+	global _reserved_until
+
+	rate = current_rate()
+	if not rate or size <= 0:
+		return
+
+	with _lock:
+		now = monotonic()
+		_reserved_until = max(_reserved_until, now) + size / rate
+		delay = _reserved_until - now - BURST_SECONDS
+
+	if delay > 0:
+		metrics.observe("bandwidth_wait_seconds", delay)
+		sleep(delay)
@@ -1,13 +1,17 @@
 from pathlib import Path
+from typing import List, Tuple
 
 from . import gql, worker
-from vodbot import chatlog
+from vodbot import chatlog, metrics
 from vodbot.util import make_dir, format_size
 from vodbot.printer import cprint
+from vodbot.progress import ProgressReporter
 from vodbot.twitch import Vod, Clip, get_video_comments
-from vodbot.config import Config
+from vodbot.config import Config, _ConfigQuality
 
 import subprocess
+import errno
+import math
 import requests
 import shutil
 import m3u8
@@ -18,11 +22,26 @@ class JoiningFailed(Exception):
 	pass
 
 
-def get_playlist_uris(video_id: str, access_token: dict):
+USHER_URL = "https://usher.ttvnw.net/vod/{video_id}"
+
+# Bytes read and written at a time when copying a joined VOD to another filesystem.
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+# Bytes left free in the temp folder on top of a joined VOD before joining there.
+JOIN_SPACE_MARGIN = 1024 * 1024 * 1024
+
+
+# Prefixes of the RFC 6381 codec strings Twitch lists for each video codec.
+CODEC_PREFIXES = {
+	"av1": ("av01",),
+	"h264": ("avc1", "avc3"),
+}
+
+
+def get_playlists(video_id: str, access_token: dict) -> List[m3u8.Playlist]:
 	"""
-	Grabs the URI's for accessing each of the video chunks.
+	Grabs the variants of a VOD, each with its stream info and the URI of its playlist.
 	"""
-	url = f"https://usher.ttvnw.net/vod/{video_id}"
+	url = USHER_URL.format(video_id=video_id)
 
 	resp = requests.get(url, timeout=5, params={
 		"token": access_token['value'],
@@ -38,59 +57,226 @@ def get_playlist_uris(video_id: str, access_token: dict):
 	data = resp.content.decode("utf-8")
 
 	playlist = m3u8.loads(data)
-	playlist_uris = [p.uri for p in playlist.playlists]
-	
-	return playlist_uris
+	return playlist.playlists
 
-def dl_video(conf: Config, video: Vod, path: str):
-	TEMP_DIR = conf.directories.temp
-	LOG_LEVEL = conf.export.ffmpeg_loglevel
-	REDIRECT = conf.export.ffmpeg_stderr
 
-	video_id = video.id
+def get_playlist_uris(video_id: str, access_token: dict):
+	"""
+	Grabs the URI's for accessing each of the video chunks.
+	"""
+	return [p.uri for p in get_playlists(video_id, access_token)]
+
+
+def _height(variant: m3u8.Playlist) -> int:
+	res = variant.stream_info.resolution
+	return res[1] if res else 0
+
+
+def _bitrate(variant: m3u8.Playlist) -> int:
+	return variant.stream_info.bandwidth or 0
+
+
+def get_quality(conf: Config, login: str) -> _ConfigQuality:
+	for channel in conf.channels:
+		if channel.username == login and channel.quality is not None:
+			return channel.quality
+	return conf.pull.quality
+
 
+def pick_variant(variants: List[m3u8.Playlist], quality: _ConfigQuality) -> str:
+	"""
+	Picks the URI of the best variant within a quality's limits, in its preferred codec if there is
+	one. If nothing is within the limits, the smallest variant is picked.
+	"""
+	# first URI is always source quality!
+	if not (quality.max_height or quality.max_bitrate or quality.codec):
+		return variants[0].uri
+
+	# audio only variants have no resolution
+	video = [v for v in variants if _height(v)] or variants
+	fits = [v for v in video
+		if (not quality.max_height or _height(v) <= quality.max_height)
+		and (not quality.max_bitrate or _bitrate(v) <= quality.max_bitrate)]
+	if not fits:
+		fits = [min(video, key=lambda v: (_height(v), _bitrate(v)))]
+
+	if quality.codec:
+		prefixes = CODEC_PREFIXES[quality.codec]
+		preferred = [v for v in fits if any(c.strip().startswith(prefixes) for c in (v.stream_info.codecs or "").split(","))]
+		fits = preferred or fits
+
+	return max(fits, key=lambda v: (_height(v), _bitrate(v))).uri
+
+def get_media_playlist(conf: Config, video: Vod) -> Tuple[str, m3u8.M3U8]:
+	"""
+	Fetches the playlist of a VOD's segments at the quality picked for its channel, returning the
+	URI it was fetched from along with it.
+	"""
 	# Grab access token
-	access_token = gql.get_access_token(video_id)
+	access_token = gql.get_access_token(video.id)
 
 	# Get M3U8 playlist, and parse them
-	# (first URI is always source quality!)
-	uris = get_playlist_uris(video_id, access_token)
-	source_uri = uris[0]
+	variants = get_playlists(video.id, access_token)
+	source_uri = pick_variant(variants, get_quality(conf, video.user_login))
 
 	# Fetch playlist at proper quality
 	resp = requests.get(source_uri)
 	resp.raise_for_status()
-	playlist = m3u8.loads(resp.text)
+	return source_uri, m3u8.loads(resp.text)
+
+
+def dl_video_segments(conf: Config, video: Vod, start: int=0) -> int:
+	"""
+	Downloads the segments of a VOD that is still being recorded, from the `start`th one of its
+	playlist onwards, into the same temp folder `dl_video` uses. Once the stream is done,
+	`dl_video` only has to fetch what was appended since and join. Returns how many segments of
+	the playlist have been downloaded, to start from next time.
+	"""
+	source_uri, playlist = get_media_playlist(conf, video)
+
+	tempdir = conf.directories.temp / video.id
+	make_dir(str(tempdir))
+
+	# the playlist only grows while recording, segments already pulled keep their place in it
+	segments = playlist.segments[min(start, len(playlist.segments)):]
+	if not segments:
+		return len(playlist.segments)
+
+	base_uri = "/".join(source_uri.split("/")[:-1]) + "/"
+	vod_paths = [segment.uri for segment in segments]
+	durations = [segment.duration for segment in segments]
+	worker.download_files(conf, video.id, base_uri, tempdir, vod_paths, durations)
+
+	return len(playlist.segments)
+
+
+def get_muted_ranges(playlist: m3u8.M3U8) -> List[dict]:
+	"""
+	Returns the ranges of a VOD's playlist made of muted segments, in whole seconds like chapters.
+	"""
+	ranges = []
+	pos = 0.0
+	for segment in playlist.segments:
+		if segment.uri.endswith("-muted.ts"):
+			if ranges and ranges[-1][1] == pos:
+				ranges[-1][1] = pos + segment.duration
+			else:
+				ranges.append([pos, pos + segment.duration])
+		pos += segment.duration
+
+	return [{"pos": int(start), "dur": math.ceil(end) - int(start)} for start, end in ranges]
+
+
+def same_filesystem(a, b) -> bool:
+	try:
+		return os.stat(a).st_dev == os.stat(b).st_dev
+	except OSError:
+		return False
+
+
+def join_target(conf: Config, tempdir: Path, path: str, size: int) -> str:
+	"""
+	Returns where FFmpeg should write a joined VOD of about `size` bytes that belongs at `path`, by
+	the join placement.
+	"""
+	placement = conf.pull.join_placement
+	if placement == "direct":
+		return path
+	# on another filesystem the VOD gets copied over in one go afterwards, which is only worth it if
+	# the temp folder has room for it next to its segments
+	if placement == "auto" and not same_filesystem(tempdir, os.path.dirname(os.path.abspath(path))):
+		try:
+			if shutil.disk_usage(tempdir).free < size + JOIN_SPACE_MARGIN:
+				return path
+		except OSError:
+			return path
+	# FFmpeg runs from the temp folder, the path has to hold up from anywhere
+	return os.path.abspath(tempdir / ("joined" + Path(path).suffix))
+
+
+def move_file(src: str, dst: str, label: str):
+	"""
+	Moves a file into place. On the same filesystem it's only renamed, otherwise it's copied over in
+	large sequential writes with progress, and only shows up at `dst` once it's all there.
+	"""
+	try:
+		os.replace(src, dst)
+		return
+	except OSError as e:
+		if e.errno != errno.EXDEV:
+			raise
+
+	tmp_path = dst + ".tmp"
+	progress = ProgressReporter(label, total_size=os.path.getsize(src))
+	view = memoryview(bytearray(COPY_BUFFER_SIZE))
+	try:
+		with open(src, "rb", buffering=0) as fsrc, open(tmp_path, "wb", buffering=0) as fdst:
+			while True:
+				n = fsrc.readinto(view)
+				if not n:
+					break
+				written = 0
+				while written < n:
+					written += fdst.write(view[written:n])
+				progress.update(n)
+		os.replace(tmp_path, dst)
+	except BaseException:
+		# a partial copy is never left at the destination
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+	progress.finish()
+
+	os.remove(src)
+
+
+def dl_video(conf: Config, video: Vod, path: str):
+	TEMP_DIR = conf.directories.temp
+	LOG_LEVEL = conf.export.ffmpeg_loglevel
+	REDIRECT = conf.export.ffmpeg_stderr
+
+	video_id = video.id
+
+	source_uri, playlist = get_media_playlist(conf, video)
 
 	# Create a temp dir in .vodbot/temp
 	tempdir = TEMP_DIR / video_id
 	make_dir(str(tempdir))
 
-	# Dump playlist to a file
-	playlist_path = tempdir / "playlist.m3u8"
-	playlist.dump(str(playlist_path))
-
 	# Get all the necessary vod paths for the uri
 	base_uri = "/".join(source_uri.split("/")[:-1]) + "/"
 	vod_paths = [segment.uri for segment in playlist.segments]
+	durations = [segment.duration for segment in playlist.segments]
 	
 	# Download VOD chunks to the temp folder
-	path_map = worker.download_files(conf, video_id, base_uri, tempdir, vod_paths)
+	path_map = worker.download_files(conf, video_id, base_uri, tempdir, vod_paths, durations)
 	# cprint("\t#dDone, now to FFmpeg join...#r")
 
-	# join the vods using FFmpeg at specified path
+	# Dump playlist to a file, pointing at the segments as they were saved
+	for segment in playlist.segments:
+		segment.uri = os.path.relpath(path_map[segment.uri], tempdir)
+	playlist_path = tempdir / "playlist.m3u8"
+	playlist.dump(str(playlist_path))
+
+	video.muted = get_muted_ranges(playlist)
+	if video.muted:
+		cprint(f"#fY#dWARN: VOD `{video_id}` has {len(video.muted)} muted part(s) that could not be pulled unmuted.#r")
+
+	# join the vods using FFmpeg, where the join placement says to
+	join_path = join_target(conf, tempdir, path, sum(os.path.getsize(p) for p in path_map.values()))
 	cwd = os.getcwd()
 	os.chdir(str(tempdir))
 	cmd = [
 		"ffmpeg", "-allowed_extensions", "ALL",
 		"-i", str(playlist_path),
-		"-c", "copy", path, "-y",
+		"-c", "copy", join_path, "-y",
 		"-stats", "-loglevel", LOG_LEVEL
 	]
 	redirect = subprocess.DEVNULL
 	if REDIRECT != Path():
 		redirect = open(REDIRECT, "w")
-	result = subprocess.run(cmd, stderr=redirect)
+	with metrics.timer("ffmpeg_seconds", op="join"):
+		result = subprocess.run(cmd, stderr=redirect)
 	if REDIRECT != Path():
 		redirect.close()
 	os.chdir(cwd)
@@ -98,6 +284,13 @@ def dl_video(conf: Config, video: Vod, path: str):
 	if result.returncode != 0:
 		raise JoiningFailed()
 
+	if join_path != path:
+		try:
+			with metrics.timer("vod_move_seconds"):
+				move_file(join_path, path, f"#fM#lVOD#r `#fM{video_id}#r` #d(moving)#r")
+		except OSError as e:
+			raise JoiningFailed() from e
+
 	# delete temp folder and contents
 	shutil.rmtree(str(tempdir))
 
@@ -115,10 +308,49 @@ def dl_video_chat(video: Vod, path: str):
 	cprint(f"\r#fM#lVOD Chat#r `#fM{video_id}#r` (100%); Done, now to write... Done")
 
 
-def dl_clip(conf: Config, clip: Clip, path: str):
+def cut_clip(conf: Config, clip: Clip, vod_path: str, path: str) -> bool:
+	"""
+	Cuts a Clip out of the pulled VOD it was made from, copying the streams as they are. Returns
+	whether FFmpeg managed to, leaving nothing behind if it didn't.
+	"""
+	LOG_LEVEL = conf.export.ffmpeg_loglevel
+	REDIRECT = conf.export.ffmpeg_stderr
+
+	cmd = [
+		"ffmpeg", "-hide_banner", "-ss", str(clip.offset),
+		"-i", vod_path, "-t", str(clip.length),
+		"-c", "copy", path, "-y",
+		"-stats", "-loglevel", LOG_LEVEL
+	]
+	redirect = subprocess.DEVNULL
+	if REDIRECT != Path():
+		redirect = open(REDIRECT, "w")
+	try:
+		with metrics.timer("ffmpeg_seconds", op="clip"):
+			returncode = subprocess.run(cmd, stderr=redirect).returncode
+	except OSError:
+		# FFmpeg couldn't be run at all, downloading still works without it
+		returncode = -1
+	if REDIRECT != Path():
+		redirect.close()
+
+	if returncode != 0:
+		if os.path.exists(path):
+			os.remove(path)
+		return False
+	return True
+
+
+def dl_clip(conf: Config, clip: Clip, path: str, vod_path: str=None):
 	clip_slug = clip.slug
 	clip_id = clip.id
 
+	# Cut it from the VOD if there is one to cut from, otherwise download it
+	if vod_path is not None and cut_clip(conf, clip, vod_path, path):
+		metrics.count("clips_cut")
+		cprint(f"#fM#lClip#r `#fM{clip_slug}#r` ({clip_id}) #fB#l{format_size(os.path.getsize(path))}#r #d(cut from VOD)#r")
+		return
+
 	# Get proper clip file URL
 	source_url = gql.get_clip_source(clip_slug)
 
@@ -1,11 +1,17 @@
 # Module to call GQL queries
 
+from . import bandwidth
+from vodbot import metrics
+
 import requests
+from time import monotonic
 from urllib.parse import urlencode
 
 
 GQL_URL = "https://gql.twitch.tv/gql"
 GQL_HEADERS = {"Client-ID": ""}
+# kept open between queries, so each one after the first skips connecting to Twitch again
+_session = requests.Session()
 
 
 class GQLException(Exception):
@@ -28,15 +34,28 @@ def _process_query_errors(resp):
 		raise GQLException(j)
 
 
-def gql_post(json=None, data=None):
+def gql_post(json=None, data=None, name=None):
 	global GQL_URL, GQL_HEADERS
-	resp = requests.post(GQL_URL, json=json, data=data, headers=GQL_HEADERS)
+	# name is only for metrics, persisted queries already carry one
+	if name is None:
+		name = json.get("operationName", "query") if json else "query"
+
+	start = monotonic()
+	try:
+		resp = _session.post(GQL_URL, json=json, data=data, headers=GQL_HEADERS)
+	except requests.RequestException:
+		metrics.count("gql_errors", query=name)
+		raise
+	metrics.observe("gql_request_seconds", monotonic() - start, query=name)
+	metrics.count("gql_requests", query=name, status=resp.status_code)
+	bandwidth.consume(len(resp.content))
+
 	_process_query_errors(resp)
 	return resp
 
 
-def gql_query(query=None, data=None):
-	return gql_post(json={"query":query}, data=data)
+def gql_query(query=None, data=None, name=None):
+	return gql_post(json={"query":query}, data=data, name=name)
 
 
 # GQL Query forms
@@ -58,7 +77,7 @@ GET_CHANNEL_CLIPS_QUERY = """
 {{  user(login: "{channel_id}") {{
 		clips(
 			first: {first}, after: {after},
-			criteria: {{ period: ALL_TIME, sort: VIEWS_DESC }}
+			criteria: {{ period: {period}, sort: VIEWS_DESC }}
 		) {{
 			pageInfo {{ hasNextPage }}
 			edges {{ cursor node {{
@@ -132,7 +151,7 @@ def get_access_token(video_id):
 	"""
 	query = VIDEO_ACCESS_QUERY.format(video_id=video_id)
 
-	resp = gql_query(query=query).json()
+	resp = gql_query(query=query, name="video_access").json()
 
 	return resp["data"]["videoPlaybackAccessToken"]
 
@@ -140,7 +159,7 @@ def get_access_token(video_id):
 def get_clip_source(clip_slug):
 	query = GET_CLIP_QUERY.format(clip_slug=clip_slug)
 
-	resp = gql_query(query=query).json()
+	resp = gql_query(query=query, name="clip").json()
 
 	url = resp["data"]["clip"]["videoQualities"][0]["sourceURL"]
 
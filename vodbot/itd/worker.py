@@ -1,16 +1,21 @@
+from . import bandwidth
+from vodbot import metrics
 from vodbot.config import Config
-from vodbot.printer import cprint
-from vodbot.util import format_duration, format_size
+from vodbot.progress import ProgressReporter
 
 import os
 import requests
 
-from datetime import datetime
 from collections import OrderedDict
-from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from functools import partial
+from heapq import heappop, heappush
+from random import uniform
+from threading import local
 from requests.exceptions import RequestException
-from typing import List, Tuple
+from time import monotonic, sleep
+from typing import Dict, List, Tuple
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from pathlib import Path
 
 
@@ -26,85 +31,330 @@ class TwitchAccessDenied(Exception):
 	pass
 
 
-def _download(url: str, path: str, timeout:float, chunk_size:int) -> int:
+class SegmentInvalid(Exception):
+	pass
+
+
+class SegmentUnavailable(DownloadFailed):
+	pass
+
+
+class RetryLater(Exception):
+	def __init__(self, retry_after: float=None):
+		super().__init__()
+		self.retry_after = retry_after
+
+
+# MPEG-TS packets are a fixed size and each starts with the same sync byte.
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# Bytes read from each end of a segment when checking it.
+TS_SCAN_SIZE = TS_PACKET_SIZE * 512
+# Timestamps in MPEG-TS tick at 90kHz.
+TS_CLOCK = 90000
+# Seconds a segment can come up short of its playlist duration, the timestamp of the last frame is
+# its start, not its end.
+DURATION_TOLERANCE = 1.0
+
+
+def _pes_timestamps(data: bytes):
+	# yields the PTS of each PES packet that starts in the given run of TS packets
+	for off in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+		if not data[off+1] & 0x40: # payload unit start
+			continue
+		adaptation = (data[off+3] >> 4) & 3
+		p = off + 4
+		if adaptation & 2:
+			p += 1 + data[p]
+		if not adaptation & 1 or p + 14 > off + TS_PACKET_SIZE:
+			continue
+		if data[p:p+3] != b"\x00\x00\x01" or not data[p+7] & 0x80:
+			continue
+		yield (((data[p+9] >> 1) & 7) << 30 | data[p+10] << 22 | (data[p+11] >> 1) << 15
+			| data[p+12] << 7 | data[p+13] >> 1)
+
+
+def _verify_segment(path: str, duration: float=None) -> bool:
+	"""
+	Checks that an MPEG-TS segment is whole packets with intact sync bytes at both ends, and if a
+	duration is given, that its timestamps cover about that long. Segments of any other container
+	are only checked for being non-empty.
+	"""
+	size = os.path.getsize(path)
+	if not path.endswith(".ts"):
+		return size > 0
+	if size == 0 or size % TS_PACKET_SIZE:
+		return False
+
+	with open(path, "rb") as f:
+		head = f.read(TS_SCAN_SIZE)
+		tail = head
+		if size > TS_SCAN_SIZE:
+			f.seek(size - TS_SCAN_SIZE)
+			tail = f.read()
+
+	for data in (head, tail):
+		syncs = data[::TS_PACKET_SIZE]
+		if syncs.count(TS_SYNC_BYTE) != len(syncs):
+			return False
+
+	if duration:
+		first = min(_pes_timestamps(head), default=None)
+		last = max(_pes_timestamps(tail), default=None)
+		# timestamps wrap around every ~26.5 hours, a segment over the wrap isn't worth judging
+		if first is not None and last is not None and last >= first:
+			if (last - first) / TS_CLOCK + DURATION_TOLERANCE < duration:
+				return False
+
+	return True
+
+
+# Smallest buffer segments are read into, configs from before reads were buffered ask for 1 KiB.
+MIN_BUFFER_SIZE = 64 * 1024
+ACCESS_DENIED = b'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>AccessDenied</Code><Message>Access Denied</Message>'
+
+# Statuses worth retrying a segment on, along with every 5xx. Any other error status gives up on it.
+RETRY_STATUSES = {408, 425, 429}
+# Seconds the first retry waits at most, doubling with each retry up to the max.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Longest wait asked for with Retry-After that is honored.
+RETRY_AFTER_MAX = 120.0
+
+# each download thread keeps one buffer for every segment it reads
+_buffers = local()
+def _get_buffer(size: int) -> memoryview:
+	view = getattr(_buffers, "view", None)
+	if view is None or len(view) != size:
+		view = _buffers.view = memoryview(bytearray(size))
+	return view
+
+
+def _retry_after(response: requests.Response) -> float:
+	# only the delay in seconds form is used, dates are rare for this
+	try:
+		return float(response.headers.get("Retry-After"))
+	except (TypeError, ValueError):
+		return None
+
+
+def backoff_delay(attempt: int, retry_after: float=None) -> float:
+	"""
+	Seconds to wait before retrying after the `attempt`th failure, counting from 0. Jittered so
+	workers that failed together don't all come back at once, and never shorter than what the
+	server asked for with Retry-After.
+	"""
+	delay = uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+	if retry_after is not None:
+		delay = max(delay, min(retry_after, RETRY_AFTER_MAX))
+	return delay
+
+
+def _download(url: str, path: str, timeout:float, chunk_size:int, duration:float=None) -> int:
 	tmp_path = path + ".tmp"
-	response = requests.get(url, stream=True, timeout=timeout)
+	# the raw body is written as it comes, so it has to come uncompressed
+	response = requests.get(url, stream=True, timeout=timeout, headers={"Accept-Encoding": "identity"})
+
+	# error pages are never written out as segments
+	if not response.ok:
+		denied = ACCESS_DENIED in response.content[:1024]
+		response.close()
+		if denied:
+			raise TwitchAccessDenied()
+		if response.status_code in RETRY_STATUSES or response.status_code >= 500:
+			raise RetryLater(_retry_after(response))
+		raise SegmentUnavailable()
+
+	view = _get_buffer(max(chunk_size, MIN_BUFFER_SIZE))
 	size = 0
-	with open(tmp_path, 'wb') as target:
-		for chunk in response.iter_content(chunk_size=chunk_size):
-			if b'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>AccessDenied</Code><Message>Access Denied</Message>' in chunk:
-				raise TwitchAccessDenied()
-			target.write(chunk)
-			size += len(chunk)
+	denied = False
+	with open(tmp_path, 'wb', buffering=0) as target:
+		while True:
+			n = response.raw.readinto(view[:bandwidth.read_size(len(view))])
+			if not n:
+				break
+			# an access denied error is a small XML document, it can only be at the very start
+			if size == 0 and view[:5] == b"<?xml" and ACCESS_DENIED in bytes(view[:min(n, 1024)]):
+				denied = True
+				break
+			written = 0
+			while written < n:
+				written += target.write(view[written:n])
+			size += n
+			bandwidth.consume(n)
+
+	if denied:
+		os.remove(tmp_path)
+		raise TwitchAccessDenied()
+
+	# a short or still encoded body would otherwise only show up when FFmpeg joins the segments
+	expected = response.headers.get("Content-Length")
+	encoding = response.headers.get("Content-Encoding", "identity")
+	if ((expected is not None and int(expected) != size) or encoding != "identity"
+		or not _verify_segment(tmp_path, duration)):
+		os.remove(tmp_path)
+		raise SegmentInvalid()
 
 	os.rename(tmp_path, path)
 	return size
 
 
-def download_file(url:str, path:str, retries:int, timeout:int, chunk_size:int) -> Tuple[int, bool]:
+def fetch_file(url:str, path:str, timeout:int, chunk_size:int, duration:float=None) -> Tuple[int, bool]:
+	"""
+	Makes one attempt at downloading a file, unless it's already downloaded. Raises RetryLater if
+	the attempt failed in a way that may not happen again.
+	"""
 	if os.path.exists(path):
-		return os.path.getsize(path), True
+		# left by a run that was stopped, possibly before its data reached the disk
+		if _verify_segment(path, duration):
+			return os.path.getsize(path), True
+		# left over from a crash or an earlier bad download, get it again
+		metrics.count("segment_invalid")
+		os.remove(path)
+
+	start = monotonic()
+	try:
+		size = _download(url, path, timeout, chunk_size, duration)
+	except (RequestException, Urllib3HTTPError):
+		# reading the raw response raises urllib3's errors rather than requests' own
+		raise RetryLater()
+	except SegmentInvalid:
+		metrics.count("segment_invalid")
+		raise RetryLater()
+	metrics.observe("segment_seconds", monotonic() - start)
+	metrics.count("segment_bytes", size)
+	return size, False
+
 
-	for _ in range(retries):
+def download_file(url:str, path:str, retries:int, timeout:int, chunk_size:int, duration:float=None) -> Tuple[int, bool]:
+	for attempt in range(retries):
+		if attempt:
+			metrics.count("segment_retries")
 		try:
-			return _download(url, path, timeout, chunk_size), False
-		except RequestException:
-			pass
+			return fetch_file(url, path, timeout, chunk_size, duration)
+		except RetryLater as e:
+			if attempt + 1 < retries:
+				sleep(backoff_delay(attempt, e.retry_after))
 
+	metrics.count("segment_failures")
 	raise DownloadFailed()
 
 
-def _print_progress(video_id: str, futures: List[Future]) -> None:
-	downloaded_count = 0
-	downloaded_size = 0
-	existing_size = 0
-	start_time = datetime.now()
-	total_count = len(futures)
+def _muted_variants(vod_path: str) -> Tuple[str, str]:
+	"""
+	Returns the path of a segment to try first, and the muted one to fall back on if that can't be
+	pulled. Twitch lists muted segments as `N-muted.ts`, and the unmuted original is sometimes still
+	up as `N.ts`. Segments that were never muted have nothing to fall back on.
+	"""
+	if vod_path.endswith("-muted.ts"):
+		return vod_path[:-len("-muted.ts")] + ".ts", vod_path
+	if vod_path.endswith("-unmuted.ts"):
+		return vod_path, vod_path[:-len("-unmuted.ts")] + "-muted.ts"
+	return vod_path, None
+
+
+def fetch_segment(base_url:str, target_dir:Path, vod_path:str, timeout:int, chunk_size:int,
+	duration:float=None) -> Tuple[int, bool, str]:
+	"""
+	Makes one attempt at downloading a VOD segment, trying the unmuted original of a muted segment
+	first. Returns its size, whether it was already downloaded, and the path it was saved under in
+	the target folder. Raises RetryLater like `fetch_file`.
+	"""
+	first, fallback = _muted_variants(vod_path)
+	# a segment pulled muted before isn't tried unmuted again
+	if fallback is not None and not os.path.exists(target_dir / first) and os.path.exists(target_dir / fallback):
+		first, fallback = fallback, None
+
+	try:
+		size, existed = fetch_file(base_url + first, str(target_dir / first), timeout, chunk_size, duration)
+		return size, existed, first
+	except (SegmentUnavailable, TwitchAccessDenied):
+		if fallback is None:
+			raise
+
+	metrics.count("segment_muted")
+	size, existed = fetch_file(base_url + fallback, str(target_dir / fallback), timeout, chunk_size, duration)
+	return size, existed, fallback
+
+
+def _run_queue(video_id: str, executor: ThreadPoolExecutor, jobs: List[partial], retries: int) -> List[str]:
+	"""
+	Runs every segment job on the pool, printing progress. Jobs that fail in a way worth retrying
+	are held back until their backoff is over and then queued behind everything else, so no worker
+	sits waiting on them. Returns what each job returned, once all of them succeeded.
+	"""
+	progress = ProgressReporter(f"#fM#lVOD#r `#fM{video_id}#r`", total_count=len(jobs))
+	results = [None] * len(jobs)
+	attempts = [0] * len(jobs)
+	failed = []
+	# (due time, job index) of jobs waiting to be retried
+	deferred: List[Tuple[float, int]] = []
+	running: Dict[Future, int] = {executor.submit(job): i for i, job in enumerate(jobs)}
 
 	try:
-		for future in as_completed(futures):
-			(size, existed) = future.result()
-			downloaded_count += 1
-			downloaded_size += size
-			if existed:
-				existing_size += size
-
-			percentage = 100 * downloaded_count / total_count
-			est_total_size = total_count * downloaded_size / downloaded_count
-			duration = (datetime.now() - start_time).seconds
-			speed = (downloaded_size - existing_size) / duration if duration else 0
-			remaining = (total_count - downloaded_count) * duration / downloaded_count
-
-			msg = " ".join([
-				f"#fM#lVOD#r `#fM{video_id}#r` pt#fC{downloaded_count}#r/#fB#l{total_count}#r,",
-				f"#fC{format_size(downloaded_size, units=False)}#r/#fB#l{format_size(est_total_size)}#r"
-				f"#d({percentage:.1f}%)#r;",
-				f"at #fY~{format_size(speed)}/s#r;" if speed > 0 else "",
-				f"#fG~{format_duration(remaining)}#r left" if speed > 0 else "",
-			])
-
-			cprint(f"#c\r{msg}", end="")
+		while running or deferred:
+			now = monotonic()
+			while deferred and deferred[0][0] <= now:
+				_, i = heappop(deferred)
+				metrics.count("segment_retries")
+				running[executor.submit(jobs[i])] = i
+
+			timeout = deferred[0][0] - now if deferred else None
+			if not running:
+				sleep(timeout)
+				continue
+			done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+			for future in done:
+				i = running.pop(future)
+				try:
+					(size, existed, saved) = future.result()
+				except RetryLater as e:
+					attempts[i] += 1
+					if attempts[i] < retries:
+						heappush(deferred, (monotonic() + backoff_delay(attempts[i] - 1, e.retry_after), i))
+					else:
+						metrics.count("segment_failures")
+						failed.append(DownloadFailed())
+					continue
+				except (DownloadFailed, TwitchAccessDenied) as e:
+					# a segment that failed is left for the next pull, the rest still get downloaded
+					failed.append(e)
+					continue
+				results[i] = saved
+				progress.update(size, count=1, existing=existed)
 	except KeyboardInterrupt:
-		_, not_done = wait(futures, timeout=0)
-		for future in not_done:
+		for future in running:
 			future.cancel()
-		wait(not_done, timeout=None)
+		wait(running, timeout=None)
 		raise DownloadCancelled()
 	
-	cprint() # to go to the next line after all the printing is done.
+	progress.finish() # to go to the next line after all the printing is done.
+
+	if failed:
+		if all(isinstance(e, TwitchAccessDenied) for e in failed):
+			raise TwitchAccessDenied()
+		raise DownloadFailed()
+
+	return results
+
 
-def download_files(conf:Config, video_id:str, base_url:str, target_dir:Path, vod_paths:List[str]) -> OrderedDict[str, str]:
-	urls = [base_url + path for path in vod_paths]
-	targets = [str(target_dir / path) for path in vod_paths]
+def download_files(conf:Config, video_id:str, base_url:str, target_dir:Path, vod_paths:List[str],
+	durations:List[float]=None) -> OrderedDict[str, str]:
+	"""
+	Downloads the segments of a VOD into a folder, returning the path each one was saved under.
+	Muted segments are saved under their unmuted name if the original could still be pulled.
+	"""
 	retries = conf.pull.connection_retries
 	timeout = conf.pull.connection_timeout
 	chunk_size = conf.pull.chunk_size
+	if durations is None or not conf.pull.verify_segment_duration:
+		durations = [None] * len(vod_paths)
 	
-	partials = (partial(download_file, url, path, retries, timeout, chunk_size)
-		for url, path in zip(urls, targets))
+	jobs = [partial(fetch_segment, base_url, target_dir, path, timeout, chunk_size, duration)
+		for path, duration in zip(vod_paths, durations)]
 
-	with ThreadPoolExecutor(max_workers=conf.pull.max_workers) as executor:
-		futures = [executor.submit(fn) for fn in partials]
-		_print_progress(video_id, futures)
+	with metrics.timer("vod_download_seconds"), ThreadPoolExecutor(max_workers=conf.pull.max_workers) as executor:
+		saved = _run_queue(video_id, executor, jobs, retries)
 
-	return OrderedDict(zip(vod_paths, targets))
+	return OrderedDict((path, str(target_dir / name)) for path, name in zip(vod_paths, saved))
@@ -0,0 +1,108 @@
+# Module to journal the progress of a pull into the temp directory as it happens, so a pull that was
+# killed partway through can pick up where it stopped. Each line is a JSON object appended as soon as
+# a VOD or Clip reaches its next step. Segments aren't journaled, a file of the right size can still
+# be missing data after a power loss, so they're checked on disk instead. The journal is cleared once
+# the cache has caught up with it.
+
+from .config import Config
+
+import json
+import os
+from threading import Lock
+from typing import Dict, List
+
+
+JOURNAL_NAME = "pull.journal"
+
+_lock = Lock()
+_file = None
+
+# job ID -> the kind of job, channel login, meta of the video, and the steps done with their info
+_jobs: Dict[str, dict] = {}
+
+
+def init_journal(conf: Config):
+	global _file
+
+	if _file is not None:
+		return
+
+	path = conf.directories.temp / JOURNAL_NAME
+	try:
+		with open(path) as f:
+			for line in f:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# cut off by whatever stopped the last run
+					continue
+				_apply(entry)
+	except FileNotFoundError:
+		pass
+
+	_file = open(path, "a")
+
+
+def _apply(entry: dict):
+	if entry["step"] == "listed":
+		# listed again after failing, the steps it got done are still done
+		steps = _jobs[entry["job"]]["steps"] if entry["job"] in _jobs else {}
+		_jobs[entry["job"]] = {"kind": entry["kind"], "channel": entry["channel"], "meta": entry["meta"], "steps": steps}
+	elif entry["job"] in _jobs:
+		_jobs[entry["job"]]["steps"][entry["step"]] = entry.get("info", {})
+
+
+def _write(entries: List[dict]):
+	with _lock:
+		if _file is None:
+			return
+		for entry in entries:
+			_apply(entry)
+			_file.write(json.dumps(entry) + "\n")
+		_file.flush()
+		# steps are few and far between, they're made to survive power loss too
+		os.fsync(_file.fileno())
+
+
+def jobs_listed(kind: str, channel: str, videos: list):
+	"""
+	Journals VODs or Clips that are about to be pulled, along with their meta so they can be pulled
+	again without listing the channel.
+	"""
+	_write([{"job": v.id, "step": "listed", "kind": kind, "channel": channel, "meta": v.to_meta()}
+		for v in videos])
+
+
+def job_step(job_id: str, step: str, **info):
+	"""
+	Journals that a job is done with a step: "chat", "joined", or "done" once its meta is written.
+	"""
+	_write([{"job": job_id, "step": step, "info": info}])
+
+
+def job_steps(job_id: str) -> Dict[str, dict]:
+	job = _jobs.get(job_id)
+	return job["steps"] if job else {}
+
+
+def jobs() -> Dict[str, dict]:
+	"""
+	Returns the jobs in the journal. Before anything is listed, these are the ones a killed pull
+	left behind.
+	"""
+	with _lock:
+		return dict(_jobs)
+
+
+def clear_journal():
+	"""
+	Empties the journal, once everything in it is also in the saved cache.
+	"""
+	with _lock:
+		_jobs.clear()
+		if _file is None:
+			return
+		_file.seek(0)
+		_file.truncate()
+		_file.flush()
+		os.fsync(_file.fileno())
@@ -0,0 +1,159 @@
+# Module to collect timings and counts from pulls, exports, and uploads. Nothing is recorded unless
+# metrics are enabled in the config, then a summary of the run is appended to a JSON lines report
+# when VodBot exits, and optionally written as a Prometheus textfile for node_exporter to pick up.
+# Long running commands like watch also flush once per cycle. Each flush only appends what was
+# recorded since the one before it, so the lines of a run add up to its summary.
+
+from .config import Config
+
+import atexit
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Dict, Tuple
+
+
+_enabled = False
+_lock = Lock()
+_command = ""
+_started = None
+_start_time = 0.0
+_report_path = Path()
+_prometheus_path = Path()
+
+# (name, sorted label pairs) -> running count, sum, min, and max of what was observed
+_series: Dict[Tuple[str, Tuple], Dict[str, float]] = {}
+# the same, only for what was observed since the report was last written to
+_pending: Dict[Tuple[str, Tuple], Dict[str, float]] = {}
+
+
+def init_metrics(conf: Config, command: str):
+	global _enabled, _command, _started, _start_time, _report_path, _prometheus_path
+
+	if not conf.metrics.enable or _enabled:
+		return
+
+	_enabled = True
+	_command = command
+	_started = datetime.now(timezone.utc)
+	_start_time = monotonic()
+	_report_path = conf.metrics.report_path
+	_prometheus_path = conf.metrics.prometheus_path
+	atexit.register(write_metrics)
+
+
+def observe(name: str, value: float, **labels):
+	"""
+	Records one measurement, like how long a request took or how many bytes it moved.
+	"""
+	if not _enabled:
+		return
+
+	key = (name, tuple(sorted(labels.items())))
+	with _lock:
+		for series in (_series, _pending):
+			s = series.get(key)
+			if s is None:
+				series[key] = {"count": 1, "sum": value, "min": value, "max": value}
+			else:
+				s["count"] += 1
+				s["sum"] += value
+				s["min"] = min(s["min"], value)
+				s["max"] = max(s["max"], value)
+
+
+def count(name: str, n: int=1, **labels):
+	# counters are observations where only the count and sum matter
+	observe(name, n, **labels)
+
+
+@contextmanager
+def timer(name: str, **labels):
+	"""
+	Observes the wall time in seconds of the block it wraps, including when it raises.
+	"""
+	if not _enabled:
+		yield
+		return
+
+	start = monotonic()
+	try:
+		yield
+	finally:
+		observe(name, monotonic() - start, **labels)
+
+
+def _run_id() -> str:
+	return f"{_started:%Y%m%dT%H%M%SZ}-{os.getpid()}"
+
+
+def flush_metrics():
+	"""
+	Writes out what was recorded since the last write, for commands that keep running.
+	"""
+	_write(final=False)
+
+
+def write_metrics():
+	_write(final=True)
+
+
+def _write(final: bool):
+	if not _enabled:
+		return
+
+	with _lock:
+		series = sorted(_series.items())
+		pending = sorted(_pending.items())
+		_pending.clear()
+
+	run = _run_id()
+	lines = [{
+		"run": run, "command": _command, "started": _started.isoformat(),
+		"duration": round(monotonic() - _start_time, 3), "final": final,
+	}]
+	for (name, labels), s in pending:
+		lines.append({"run": run, "metric": name, "labels": dict(labels), **s})
+
+	# a cycle where nothing happened adds nothing to the report
+	if final or pending:
+		try:
+			with open(_report_path, "a") as f:
+				for line in lines:
+					f.write(json.dumps(line) + "\n")
+		except OSError:
+			pass
+
+	if _prometheus_path != Path():
+		_write_prometheus(series)
+
+
+def _prometheus_escape(value) -> str:
+	return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_labels(labels: Tuple) -> str:
+	labels = (("command", _command),) + labels
+	return "{" + ",".join(f'{k}="{_prometheus_escape(v)}"' for k, v in labels) + "}"
+
+
+def _write_prometheus(series):
+	# node_exporter may read the file at any time, so it's written elsewhere and moved into place
+	out = [f'vodbot_run_duration_seconds{{command="{_prometheus_escape(_command)}"}} {monotonic() - _start_time:.3f}']
+	for (name, labels), s in series:
+		l = _prometheus_labels(labels)
+		out.append(f"vodbot_{name}_count{l} {s['count']}")
+		out.append(f"vodbot_{name}_sum{l} {s['sum']}")
+		out.append(f"vodbot_{name}_max{l} {s['max']}")
+
+	tmp_path = Path(str(_prometheus_path) + ".tmp")
+	try:
+		with open(tmp_path, "w") as f:
+			f.write("\n".join(out) + "\n")
+		os.replace(tmp_path, _prometheus_path)
+	except OSError:
+		pass
@@ -1,3 +1,4 @@
+import re
 from sys import argv as sys_argv, stdout
 
 # Taken from https://github.com/tartley/colorama#recognised-ansi-sequences
@@ -28,21 +29,20 @@ COLOR_CODES = {
 	"bW": "\033[47m"
 }
 
-USE_COLOR = ("--no-color" not in sys_argv) and ("-n" not in sys_argv) and (stdout.isatty())
+# every code in one pass, longest codes first so "#fR" is never read as something shorter
+COLOR_PATTERN = re.compile("#(" + "|".join(sorted(COLOR_CODES, key=len, reverse=True)) + ")")
+
+IS_TTY = stdout.isatty()
+USE_COLOR = ("--no-color" not in sys_argv) and ("-n" not in sys_argv) and IS_TTY
 
 def colorize(text: str):
 	if not USE_COLOR:
 		return strip_color(text)
 
-	for k, v in COLOR_CODES.items():
-		text = text.replace("#" + k, v)
-
-	return text
+	return COLOR_PATTERN.sub(lambda m: COLOR_CODES[m.group(1)], text)
 
 def strip_color(text: str):
-	for k in COLOR_CODES:
-		text = text.replace("#" + k, "")
-	return text
+	return COLOR_PATTERN.sub("", text)
 
 def cprint(*args, **kwargs):
 	args = [colorize(txt) for txt in args]
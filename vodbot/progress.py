@@ -0,0 +1,156 @@
+# Progress reporting for long transfers, shared by segment downloads and uploads. Lines are redrawn
+# at a fixed rate no matter how often progress is made, and when output isn't a terminal, progress
+# is written as JSON lines at a slower rate instead of a constantly rewritten line. Transfers that
+# run alongside others in the same terminal print each update on a new line, also at the slower
+# rate, since redrawing would write over each other.
+
+from vodbot.printer import IS_TTY, colorize, strip_color
+from vodbot.util import format_duration, format_size
+
+import json
+from sys import stdout
+from threading import Lock
+from time import monotonic
+
+
+# Seconds between redraws of a progress line in a terminal, and between JSON lines otherwise.
+TTY_INTERVAL = 0.25
+MACHINE_INTERVAL = 5
+# Weight of the newest speed sample in the running average.
+SPEED_WEIGHT = 0.3
+
+
+class ProgressReporter:
+	"""
+	Tracks bytes (and optionally parts) done of a transfer and reports them at a fixed rate. Call
+	`update` or `set` as often as needed, only a call past the refresh interval formats anything.
+	"""
+
+	def __init__(self, label: str, total_size: int=None, total_count: int=None, done_size: int=0,
+		machine: bool=None, shared: bool=False):
+		self.label = label
+		self.total_size = total_size
+		self.total_count = total_count
+		self.done_size = done_size
+		self.done_count = 0
+		# bytes that were already there, these aren't counted towards speed
+		self.existing_size = 0
+		# running average of bytes per second
+		self.speed = 0.0
+
+		self.machine = (not IS_TTY) if machine is None else machine
+		self.shared = shared
+		self.interval = MACHINE_INTERVAL if self.machine or self.shared else TTY_INTERVAL
+
+		self._lock = Lock()
+		self._start = monotonic()
+		self._last_time = self._start
+		self._last_size = done_size
+		self._last_render = None
+
+		# the colors are only worked out once, each redraw fills in these templates
+		self._prefix = colorize(f"{label}" if shared else f"#c\r{label}")
+		self._parts = colorize("pt#fC{}#r/#fB#l{}#r,")
+		self._sizes = colorize("#fC{}#r/#fB#l{}#r #d({:.1f}%)#r")
+		self._rate = colorize("; at #fY~{}/s#r; #fG~{}#r left")
+
+	def update(self, size: int=0, count: int=0, existing: bool=False) -> None:
+		"""
+		Adds newly finished bytes and parts, `existing` ones were already done before this run.
+		"""
+		with self._lock:
+			self.done_size += size
+			self.done_count += count
+			if existing:
+				self.existing_size += size
+			self._tick()
+
+	def set(self, done_size: int) -> None:
+		with self._lock:
+			self.done_size = done_size
+			self._tick()
+
+	def finish(self) -> None:
+		with self._lock:
+			self._tick(force=True)
+			if not self.machine and not self.shared:
+				print()
+
+	def _tick(self, force: bool=False) -> None:
+		now = monotonic()
+		if not force and self._last_render is not None and now - self._last_render < self.interval:
+			return
+
+		# the first render only sets the starting point, a sample over no time at all means nothing
+		elapsed = now - self._last_time
+		if self._last_render is None:
+			self._last_time = now
+			self._last_size = self.done_size - self.existing_size
+		elif elapsed > 0:
+			moved = (self.done_size - self.existing_size) - self._last_size
+			sample = max(moved, 0) / elapsed
+			if self.speed:
+				self.speed += SPEED_WEIGHT * (sample - self.speed)
+			else:
+				self.speed = sample
+			self._last_time = now
+			self._last_size = self.done_size - self.existing_size
+
+		self._last_render = now
+		if self.machine:
+			self._write_machine(now, force)
+		else:
+			self._write_line()
+
+	def _estimate_total(self) -> int:
+		if self.total_size is not None:
+			return self.total_size
+		if self.total_count and self.done_count:
+			return int(self.total_count * self.done_size / self.done_count)
+		return None
+
+	def _percentage(self) -> float:
+		if self.total_count:
+			return 100 * self.done_count / self.total_count
+		if self.total_size:
+			return 100 * self.done_size / self.total_size
+		return 0.0
+
+	def _remaining(self, total: int) -> float:
+		if not self.speed or total is None:
+			return None
+		return max(total - self.done_size, 0) / self.speed
+
+	def _write_line(self) -> None:
+		total = self._estimate_total()
+		remaining = self._remaining(total)
+
+		msg = self._prefix + " "
+		if self.total_count:
+			msg += self._parts.format(self.done_count, self.total_count) + " "
+		msg += self._sizes.format(format_size(self.done_size, units=False),
+			format_size(total) if total is not None else "?", self._percentage())
+		if remaining is not None:
+			msg += self._rate.format(format_size(self.speed), format_duration(remaining))
+		if self.shared:
+			msg += "\n"
+
+		stdout.write(msg)
+		stdout.flush()
+
+	def _write_machine(self, now: float, finished: bool) -> None:
+		total = self._estimate_total()
+		remaining = self._remaining(total)
+		stdout.write(json.dumps({
+			"progress": strip_color(self.label),
+			"done": self.done_size,
+			"total": total,
+			"parts_done": self.done_count if self.total_count else None,
+			"parts_total": self.total_count,
+			"percent": round(self._percentage(), 1),
+			"speed": round(self.speed),
+			"eta": round(remaining, 1) if remaining is not None else None,
+			"elapsed": round(now - self._start, 3),
+			"finished": finished,
+		}) + "\n")
+		stdout.flush()
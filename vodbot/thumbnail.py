@@ -5,8 +5,10 @@ from .printer import cprint
 from .config import Config
 from .commands.stage import StageData
 
+import os
 import subprocess
 from pathlib import Path
+from typing import Dict, Tuple
 from PIL import Image, ImageDraw, ImageFont
 
 
@@ -14,31 +16,107 @@ class ScreengrabFailed(Exception):
 	pass
 
 
-# take in a StageData, process the data given the config, spit out the path to the image
-def generate_thumbnail(conf: Config, stage: StageData) -> Path:
-	if not stage.thumbnail:
-		cprint(f"#fY#dWARN: Cannot generate thumbnail, missing thumbnail data for stage `{stage.id}`.#r")
-		return None
+# decoded and scaled images, kept for the life of the process so that exporting or uploading many
+# stages doesn't decode and resample the same assets over and over.
+# keyed by (path, mtime, size), where a size of None is the image at its original size.
+_image_cache: Dict[Tuple[str, int, Tuple[int, int]], Image.Image] = {}
+
+
+def _load_image(path: Path, size: Tuple[int, int]=None) -> Image.Image:
+	path = str(path)
+	key = (path, os.stat(path).st_mtime_ns, size)
+
+	img = _image_cache.get(key)
+	if img is None:
+		if size is None:
+			with Image.open(path) as f:
+				img = f.convert("RGBA")
+		else:
+			img = _load_image(path).resize(size, Image.BICUBIC)
+		_image_cache[key] = img
 
-	# to get single frame from a video
-	# "ffmpeg" "-ss" "<timestamp>" "-i" "<inputvod.mkv>" "-frames:v" "1" "<tmp/screenshot_output.png>"
-	ss_path = conf.directories.temp / f"thumbnail_ss_{stage.id}.png"
-	selected_video_slice = stage.thumbnail.video_slice_id
-	video_slice = stage.slices[selected_video_slice]
+	return img
+
+
+def _load_scaled_image(path: Path, scale: float) -> Image.Image:
+	w, h = _load_image(path).size
+	return _load_image(path, (int(w*scale), int(h*scale)))
+
+
+def _cover_layer(conf: Config) -> Image.Image:
+	# the cover is the same for every stage, so it is placed on its own canvas sized layer once
+	cw = conf.thumbnail.canvas_width
+	ch = conf.thumbnail.canvas_height
+	cvp = conf.thumbnail.cover_position
+	cover_path = conf.directories.thumbnail / conf.thumbnail.cover_filepath
+	cvs = cvp.s
+	cvx, cvy = int(cvp.x - (cvp.ox * cvs)), int(cvp.y - (cvp.oy * cvs))
+
+	key = (f"cover:{cover_path}", os.stat(cover_path).st_mtime_ns, (cw, ch, cvx, cvy, cvs))
+	layer = _image_cache.get(key)
+	if layer is None:
+		layer = Image.new("RGBA", (cw, ch), (0,0,0,0))
+		layer.alpha_composite(_load_image(cover_path, (int(cw*cvs), int(ch*cvs))), (cvx, cvy))
+		_image_cache[key] = layer
+
+	return layer
+
+
+def preload_assets(conf: Config) -> None:
+	# fills the image cache with everything that doesn't depend on a stage, missing files are left
+	# for generate_thumbnail to warn about
+	icons = list(conf.thumbnail.heads.values()) + list(conf.thumbnail.games.values())
+	gp = conf.thumbnail.game_position
+	try:
+		if conf.thumbnail.cover_filepath != Path(""):
+			_cover_layer(conf)
+	except OSError:
+		pass
+
+	for icon in icons:
+		try:
+			_load_image(conf.directories.thumbnail / icon.filepath)
+		except OSError:
+			pass
+
+	for game in conf.thumbnail.games.values():
+		try:
+			_load_scaled_image(conf.directories.thumbnail / game.filepath, game.s * gp.s)
+		except OSError:
+			pass
+
+
+def grab_screenshot(conf: Config, stage: StageData, size: Tuple[int, int]) -> Image.Image:
+	# to get single frame from a video, already scaled and as raw pixels straight into memory
+	# "ffmpeg" "-ss" "<timestamp>" "-i" "<inputvod.mkv>" "-frames:v" "1" "-vf" "scale=<w>:<h>"
+	# "-f" "rawvideo" "-pix_fmt" "rgba" "pipe:1"
+	video_slice = stage.slices[stage.thumbnail.video_slice_id]
+	w, h = size
 
 	redirect = subprocess.DEVNULL
 	if conf.export.ffmpeg_stderr != Path():
 		redirect = open(conf.export.ffmpeg_stderr, "w")
 	result = subprocess.run([
 		"ffmpeg", "-hide_banner", "-ss", stage.thumbnail.timestamp, "-i", video_slice.filepath,
-		"-frames:v", "1", "-update", "1", str(ss_path), "-y", "-loglevel", conf.export.ffmpeg_loglevel
-	], stderr=redirect)
+		"-frames:v", "1", "-vf", f"scale={w}:{h}:flags=bicubic", "-f", "rawvideo", "-pix_fmt", "rgba",
+		"pipe:1", "-loglevel", conf.export.ffmpeg_loglevel
+	], stdout=subprocess.PIPE, stderr=redirect)
 	if conf.export.ffmpeg_stderr != Path():
 		redirect.close()
 
-	if result.returncode != 0:
+	if result.returncode != 0 or len(result.stdout) != w * h * 4:
 		raise ScreengrabFailed()
 
+	# frombuffer shares the memory of the pipe output rather than copying it
+	return Image.frombuffer("RGBA", size, result.stdout, "raw", "RGBA", 0, 1)
+
+
+# take in a StageData, process the data given the config, spit out the path to the image
+def generate_thumbnail(conf: Config, stage: StageData) -> Path:
+	if not stage.thumbnail:
+		cprint(f"#fY#dWARN: Cannot generate thumbnail, missing thumbnail data for stage `{stage.id}`.#r")
+		return None
+
 	output_file = conf.directories.temp / f"thumbnail_{stage.id}.png"
 
 	# setup
@@ -51,10 +129,7 @@ def generate_thumbnail(conf: Config, stage: StageData) -> Path:
 	ssp = conf.thumbnail.screenshot_position
 	sss = ssp.s
 	ssx, ssy = int(ssp.x - (ssp.ox * sss)), int(ssp.y - (ssp.oy * sss))
-	ssi = Image.open(ss_path)
-	ssi = ssi.convert("RGBA")
-	ssi = ssi.resize((cw, ch), Image.BICUBIC)
-	ssi = ssi.resize((int(ssi.size[0]*sss), int(ssi.size[1]*sss)), Image.BICUBIC)
+	ssi = grab_screenshot(conf, stage, (int(cw*sss), int(ch*sss)))
 	tn.alpha_composite(ssi, (ssx, ssy))
 	ssi.close()
 
@@ -62,16 +137,7 @@ def generate_thumbnail(conf: Config, stage: StageData) -> Path:
 	# only produce cover art if its linked
 	try:
 		if conf.thumbnail.cover_filepath != nofile:
-			cvp = conf.thumbnail.cover_position
-			cover_path = conf.directories.thumbnail / conf.thumbnail.cover_filepath
-			cvs = cvp.s
-			cvx, cvy = int(cvp.x - (cvp.ox * cvs)), int(cvp.y - (cvp.oy * cvs))
-			cvi = Image.open(cover_path)
-			cvi = cvi.convert("RGBA")
-			cvi = cvi.resize((cw, ch), Image.BICUBIC)
-			cvi = cvi.resize((int(cvi.size[0]*cvs), int(cvi.size[1]*cvs)), Image.BICUBIC)
-			tn.alpha_composite(cvi, (cvx, cvy))
-			cvi.close()
+			tn.alpha_composite(_cover_layer(conf))
 	except FileNotFoundError as e:
 		cprint(f"#fY#dWARN: Cannot find cover image, `{e.filename}`.#r")
 	except IsADirectoryError as e:
@@ -92,11 +158,7 @@ def generate_thumbnail(conf: Config, stage: StageData) -> Path:
 			hs = head.s * head_pos.s
 			hx = int(head_pos.x - ((head_pos.ox + head.ox) * hs))
 			hy = int(head_pos.y - ((head_pos.oy + head.oy) * hs))
-			hi = Image.open(head_path)
-			hi = hi.convert("RGBA")
-			hi = hi.resize((int(hi.size[0]*hs), int(hi.size[1]*hs)), Image.BICUBIC)
-			tn.alpha_composite(hi, (hx, hy))
-			hi.close()
+			tn.alpha_composite(_load_scaled_image(head_path, hs), (hx, hy))
 
 	# game
 	# only produce game if games are configured and data for it exists in the stage
@@ -106,11 +168,7 @@ def generate_thumbnail(conf: Config, stage: StageData) -> Path:
 		gp = conf.thumbnail.game_position
 		gs = game.s * gp.s
 		gx, gy = int(gp.x - ((gp.ox + game.ox) * gs)), int(gp.y - ((gp.oy + game.oy) * gs))
-		gi = Image.open(game_path)
-		gi = gi.convert("RGBA")
-		gi = gi.resize((int(gi.size[0]*gs), int(gi.size[1]*gs)), Image.BICUBIC)
-		tn.alpha_composite(gi, (gx, gy))
-		gi.close()
+		tn.alpha_composite(_load_scaled_image(game_path, gs), (gx, gy))
 
 	# text
 	# only produce text if font is configured correctly (and if there is actually text to print)
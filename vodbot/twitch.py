@@ -1,6 +1,6 @@
 # Module to make API calls to Twitch.tv
 
-from typing import List
+from typing import Container, List
 from .itd import gql
 
 import json
@@ -26,7 +26,7 @@ class Vod:
 		id:str, user_id:str, user_login:str, user_name:str, title:str,
 		created_at:str, length:int, chapters:List[VodChapter],
 		game_id:str="", game_name:str="",
-		has_chat:bool = False
+		has_chat:bool = False, recording:bool = False
 	):
 		self.id = id
 		self.user_id = user_id
@@ -45,13 +45,30 @@ class Vod:
 		self.url = f"https://twitch.tv/videos/{self.id}"
 
 		self.has_chat = has_chat
+		# still being streamed, its length and playlist keep growing until it's done
+		self.recording = recording
+		# ranges of the video that Twitch muted, known once its segments are pulled
+		self.muted: List[dict] = []
 	
 	def __repr__(self):
 		# ID by STREAMER at DATETIME, LENGTH
 		return f"Vod({self.id}, {self.user_name}, {self.created_at}, {self.length}s)"
 	
-	def write_meta(self, filename):
-		jsondict = {
+	@classmethod
+	def from_meta(cls, meta: dict) -> "Vod":
+		vod = cls(
+			id=meta["id"], length=meta["length"], title=meta["title"],
+			user_id=meta["user_id"], user_login=meta["user_login"], user_name=meta["user_name"],
+			game_id=meta["game_id"], game_name=meta["game_name"], created_at=meta["created_at"],
+			chapters=[VodChapter(position=c["pos"], duration=c["dur"], type=c["type"], description=c["desc"])
+				for c in meta["chapters"]],
+			has_chat=meta["has_chat"]
+		)
+		vod.muted = meta.get("muted", [])
+		return vod
+
+	def to_meta(self) -> dict:
+		return {
 			"id": self.id,
 			"user_id": self.user_id,
 			"user_login": self.user_login,
@@ -62,11 +79,13 @@ class Vod:
 			"created_at": self.created_at,
 			"length": self.length,
 			"has_chat": self.has_chat,
-			"chapters": [x.to_dict() for x in self.chapters]
+			"chapters": [x.to_dict() for x in self.chapters],
+			"muted": self.muted
 		}
-		
+	
+	def write_meta(self, filename):
 		with open(filename, "w") as f:
-			json.dump(jsondict, f, sort_keys=True, indent=4)
+			json.dump(self.to_meta(), f, sort_keys=True, indent=4)
 
 
 class Clip:
@@ -103,8 +122,18 @@ class Clip:
 		# ID by CLIPPER of STREAMER at DATETIME, LENGTH
 		return f"Clip({self.slug}, {self.clipper_name}, {self.user_name}, {self.created_at}, {self.length}s)"
 	
-	def write_meta(self, filename):
-		jsondict = {
+	@classmethod
+	def from_meta(cls, meta: dict) -> "Clip":
+		return cls(
+			id=meta["id"], slug=meta["slug"], title=meta["title"], created_at=meta["created_at"],
+			user_id=meta["user_id"], user_login=meta["user_login"], user_name=meta["user_name"],
+			clipper_id=meta["clipper_id"], clipper_login=meta["clipper_login"], clipper_name=meta["clipper_name"],
+			game_id=meta["game_id"], game_name=meta["game_name"], view_count=meta["view_count"],
+			length=meta["length"], offset=meta["offset"], video_id=meta["video_id"]
+		)
+
+	def to_meta(self) -> dict:
+		return {
 			"id": self.id,
 			"slug": self.slug,
 			"user_id": self.user_id,
@@ -122,9 +151,10 @@ class Clip:
 			"offset": self.offset,
 			"video_id": self.video_id
 		}
-		
+	
+	def write_meta(self, filename):
 		with open(filename, "w") as f:
-			json.dump(jsondict, f, sort_keys=True, indent=4)
+			json.dump(self.to_meta(), f, sort_keys=True, indent=4)
 
 
 class Channel:
@@ -171,7 +201,7 @@ def get_channels(channel_logins: List[str]) -> List[Channel]:
 	channels = []
 	for channel_login in channel_logins:
 		query = gql.GET_CHANNEL_QUERY.format(channel_login=channel_login)
-		resp = gql.gql_query(query=query).json()
+		resp = gql.gql_query(query=query, name="channel").json()
 		c = resp["data"]["user"]
 
 		if c == None:
@@ -187,11 +217,15 @@ def get_channels(channel_logins: List[str]) -> List[Channel]:
 	return channels
 
 
-def get_channel_vods(channel: Channel) -> List[Vod]:
+def get_channel_vods(channel: Channel, since: str=None, skip: Container[str]=(), recording: bool=False) -> List[Vod]:
 	"""
 	Uses a (blocking) HTTP request to retrieve VOD info for a specific channel.
 
 	:param channel: A Channel object.
+	:param since: A timestamp string, VODs published before it are not listed or paged through.
+	:param skip: IDs of VODs to leave out, saving the queries for their chapters.
+	:param recording: Also list VODs of streams that are still live, marked as recording and
+		without chapters.
 	:returns: A list of VOD objects.
 	"""
 
@@ -206,7 +240,7 @@ def get_channel_vods(channel: Channel) -> List[Vod]:
 			after=pagination, first=100,
 			sort="TIME"
 		)
-		resp = gql.gql_query(query=query).json()
+		resp = gql.gql_query(query=query, name="channel_videos").json()
 
 		if not resp["data"]["user"]:
 			raise gql.GQLItemError(f"Failed to find channel videos for `{channel.login}`.")
@@ -222,12 +256,19 @@ def get_channel_vods(channel: Channel) -> List[Vod]:
 			v = vod["node"]
 			c, g, b, s = v["creator"], v["game"], v["broadcastType"], v["status"]
 
+			# videos are sorted newest first, everything from here on is older
+			if since is not None and v["publishedAt"] < since:
+				tempcursor = None
+				break
+			if v["id"] in skip:
+				continue
+
 			# check broadcast type
 			if not any(b==t for t in ["ARCHIVE", "HIGHLIGHT", "UPLOAD", "PAST_PREMIERE"]):
 				continue
 			# This video is still be processed (or is live) and it must be skipped.
 			# if b == "ARCHIVE" and s == "RECORDING":
-			if s != "RECORDED":
+			if s != "RECORDED" and not (recording and b == "ARCHIVE" and s == "RECORDING"):
 				continue
 
 			game_id = game_name = ""
@@ -236,15 +277,15 @@ def get_channel_vods(channel: Channel) -> List[Vod]:
 				game_id, game_name = g["id"], g["name"]
 			
 			
-			# Get stream chapter info now
+			# Get stream chapter info now, streams still being recorded get theirs once they're done
 			chapters = []
 			chapter_page = "null"
 
-			while True:
+			while s == "RECORDED":
 				query = gql.GET_VIDEO_CHAPTERS.format(
 					id=v["id"], after=chapter_page
 				)
-				resp = gql.gql_query(query=query).json()
+				resp = gql.gql_query(query=query, name="video_chapters").json()
 				
 				if not resp["data"]["video"]:
 					raise gql.GQLItemError(f"Failed to find moments for video `{v['id']}`.")
@@ -278,7 +319,7 @@ def get_channel_vods(channel: Channel) -> List[Vod]:
 					id=v["id"], length=v["lengthSeconds"], title=v["title"],
 					user_id=c["id"], user_login=c["login"], user_name=c["displayName"], 
 					game_id=game_id, game_name=game_name, created_at=v["publishedAt"],
-					chapters=chapters
+					chapters=chapters, recording=s == "RECORDING"
 				)
 			)
 
@@ -291,11 +332,12 @@ def get_channel_vods(channel: Channel) -> List[Vod]:
 	return vods
 
 
-def get_channel_clips(channel: Channel) -> List[Clip]:
+def get_channel_clips(channel: Channel, period: str="ALL_TIME") -> List[Clip]:
 	"""
 	Uses a (blocking) HTTP request to retrieve Clip info for a specific channel.
 
 	:param channel: A Channel object.
+	:param period: How far back to list clips, one of LAST_DAY, LAST_WEEK, LAST_MONTH, or ALL_TIME.
 	:returns: A list of Clip objects.
 	"""
 
@@ -305,9 +347,9 @@ def get_channel_clips(channel: Channel) -> List[Clip]:
 	while True:
 		query = gql.GET_CHANNEL_CLIPS_QUERY.format(
 			channel_id=channel.login,
-			after=pagination, first=100
+			after=pagination, first=100, period=period
 		)
-		resp = gql.gql_query(query=query).json()
+		resp = gql.gql_query(query=query, name="channel_clips").json()
 
 		if not resp["data"]["user"]:
 			raise gql.GQLItemError(f"Failed to find channel clips for `{channel.login}`.")
@@ -367,7 +409,7 @@ def get_video_comments(video_id: str) -> List[ChatMessage]:
 		query = gql.GET_VIDEO_COMMENTS_QUERY.format(
 			video_id=video_id, first=100, after=pagination
 		)
-		resp = gql.gql_query(query=query).json()
+		resp = gql.gql_query(query=query, name="video_comments").json()
 		
 		if not resp["data"]["video"]:
 			raise gql.GQLItemError(f"Failed to find comments for video `{video_id}`.")
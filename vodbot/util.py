@@ -1,10 +1,15 @@
 # Module to pull and create different files and directories on the OS
 
 from .printer import cprint
-from .config import Config, DEFAULT_CONFIG_SCHEMA
+from . import __version__
+from .config import Config, get_config_schema
 
 import os
 import sys
+import shutil
+import hashlib
+import json
+from pathlib import Path
 from json.decoder import JSONDecodeError
 from marshmallow import ValidationError
 from typing import Tuple
@@ -77,11 +82,69 @@ def format_size(bytes_:int, digits:int=1, units:bool=True) -> str:
 	return f"{t} ZB" if units else t
 
 
-_has_ffmpeg = which("ffmpeg") is not None
+# checked on first use rather than on import, searching PATH slows down startup
+_has_ffmpeg = None
 def has_ffmpeg() -> bool:
+	global _has_ffmpeg
+
+	if _has_ffmpeg is None:
+		_has_ffmpeg = which("ffmpeg") is not None
+
 	return _has_ffmpeg
 
 
+# ioctl request number for cloning a file on copy-on-write filesystems (btrfs, xfs, etc.)
+_FICLONE = 0x40049409
+def clone_file(src, dst) -> str:
+	"""
+	Produces a copy of a file as cheaply as the OS allows. A reflink is tried first, then a
+	hardlink, and lastly an in-kernel copy that never passes the data through Python.
+
+	:param src: Path of the file to copy.
+	:param dst: Path of where the copy should be made. Overwritten if it exists.
+	:returns: A string of how the copy was made, "reflink", "hardlink", or "copy".
+	"""
+	src, dst = str(src), str(dst)
+	if os.path.lexists(dst):
+		os.remove(dst)
+
+	# copy-on-write clone, only supported on some filesystems
+	try:
+		import fcntl
+		with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+			fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+		return "reflink"
+	except (ImportError, OSError):
+		if os.path.lexists(dst):
+			os.remove(dst)
+
+	# hardlink, only works on the same filesystem
+	try:
+		os.link(src, dst)
+		return "hardlink"
+	except OSError:
+		pass
+
+	# copy_file_range keeps the copy in the kernel, copyfile uses sendfile where it can
+	copy_file_range = getattr(os, "copy_file_range", None)
+	if copy_file_range is not None:
+		try:
+			with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+				remaining = os.fstat(fsrc.fileno()).st_size
+				while remaining > 0:
+					copied = copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+					if copied == 0:
+						break
+					remaining -= copied
+			if remaining == 0:
+				return "copy"
+		except OSError:
+			pass
+
+	shutil.copyfile(src, dst)
+	return "copy"
+
+
 def make_dir(directory):
 	"""
 	Creates the directory structure to house the configuration data and VODs.
@@ -94,14 +157,72 @@ def make_dir(directory):
 		exit_prog(code=-3, errmsg=str(e))
 
 
+# Validated configs are snapshotted next to the config file, keyed by the hash of the config file,
+# of the modules defining the config classes and their defaults, and of the parts of the machine
+# those defaults are taken from. Later runs with an unchanged config skip building the schema and
+# validating entirely, and any change to any of these invalidates the snapshot.
+_schema_fingerprint = None
+def _conf_snapshot_key(raw: bytes) -> str:
+	global _schema_fingerprint
+
+	if _schema_fingerprint is None:
+		from . import config, fastload
+		# defaults for the number of workers and for every directory come from the environment
+		h = hashlib.sha256(f"{__version__} {sys.version_info[:2]} {os.cpu_count()} {fastload.DEFAULT_CONFIG_DIRECTORY}".encode())
+		for module in [config, fastload]:
+			with open(module.__file__, "rb") as f:
+				h.update(f.read())
+		_schema_fingerprint = h.hexdigest()
+
+	return hashlib.sha256(_schema_fingerprint.encode() + raw).hexdigest()
+
+
+def _conf_snapshot_path(filename) -> Path:
+	filename = Path(filename)
+	return filename.parent / f".{filename.name}.snapshot"
+
+
+def _read_conf_snapshot(filename, key: str) -> Config:
+	# snapshots are plain JSON like the config itself, rebuilt straight into the config classes
+	# without the schema, so nothing in them is ever run
+	try:
+		with open(_conf_snapshot_path(filename), "r") as f:
+			snapshot = json.load(f)
+		if snapshot["key"] == key:
+			return Config.from_dict(snapshot["config"])
+	except Exception:
+		# missing, stale, or unreadable snapshots are simply rebuilt
+		pass
+
+	return None
+
+
+def _write_conf_snapshot(filename, key: str, conf: Config) -> None:
+	path = _conf_snapshot_path(filename)
+	tmp_path = path.with_name(path.name + ".tmp")
+	try:
+		with open(tmp_path, "w") as f:
+			json.dump({"key": key, "config": conf.to_dict(encode_json=True)}, f)
+		os.replace(tmp_path, path)
+	except OSError:
+		# not being able to snapshot only costs time on the next run
+		pass
+
+
 # only one config per running instance.
 _cached_config = None
 def load_conf_wrapper(filename) -> Config:
 	global _cached_config
 	
 	if _cached_config is None:
-		with open(filename) as f:
-			_cached_config = DEFAULT_CONFIG_SCHEMA.loads(f.read())
+		with open(filename, "rb") as f:
+			raw = f.read()
+
+		key = _conf_snapshot_key(raw)
+		_cached_config = _read_conf_snapshot(filename, key)
+		if _cached_config is None:
+			_cached_config = get_config_schema().loads(raw.decode("utf-8"))
+			_write_conf_snapshot(filename, key, _cached_config)
 	
 	return _cached_config
 
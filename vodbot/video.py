@@ -1,12 +1,15 @@
 # Module that manages shelling out commands to FFmpeg, with functions returning paths to the final video.
 
+from . import metrics
 from .printer import cprint
 from .commands.stage import StageData, VideoSlice
 from .config import Config
+from .util import clone_file, timestring_as_seconds
 
 import os
 import subprocess
 from pathlib import Path
+from threading import Condition, Thread
 from typing import List
 
 
@@ -25,8 +28,26 @@ class FailedToCleanUp(VideoFailure):
 	pass
 
 
-def slice_video(TEMP_DIR: Path, LOG_LEVEL: str, vslice: VideoSlice, REDIRECT: Path, i: int, total: int) -> Path:
-	tmpfile = TEMP_DIR / f"{vslice.video_id}={i}.mp4"
+def is_full_slice(vslice: VideoSlice) -> bool:
+	return timestring_as_seconds(vslice.ss) == 0 and vslice.to == "EOF"
+
+
+def clone_video(TEMP_DIR: Path, stage_id: str, vslice: VideoSlice, i: int, total: int) -> Path:
+	# keep the source container, remuxing a whole file into a new one is just a slow copy
+	# temp files are named after the stage too, other stages may be cutting the same VOD at once
+	tmpfile = TEMP_DIR / f"{stage_id}={vslice.video_id}={i}{Path(vslice.filepath).suffix}"
+	cprint(f"#rCopying stage part ({i+1}/{total}) `#fM{vslice.video_id}#r` #d(full length)#r")
+
+	try:
+		clone_file(vslice.filepath, tmpfile)
+	except OSError as e:
+		raise FailedToSlice(vslice.video_id) from e
+
+	return tmpfile
+
+
+def slice_video(TEMP_DIR: Path, LOG_LEVEL: str, stage_id: str, vslice: VideoSlice, REDIRECT: Path, i: int, total: int) -> Path:
+	tmpfile = TEMP_DIR / f"{stage_id}={vslice.video_id}={i}.mp4"
 	cprint(f"#rSlicing stage part ({i+1}/{total}) `#fM{vslice.video_id}#r` #d({vslice.ss} - {vslice.to})#r")
 
 	cmd = [ "ffmpeg", "-hide_banner", "-ss", vslice.ss ]
@@ -42,7 +63,8 @@ def slice_video(TEMP_DIR: Path, LOG_LEVEL: str, vslice: VideoSlice, REDIRECT: Pa
 	redirect = subprocess.DEVNULL
 	if REDIRECT != Path():
 		redirect = open(REDIRECT, "w")
-	result = subprocess.run(cmd, stderr=redirect)
+	with metrics.timer("ffmpeg_seconds", op="slice"):
+		result = subprocess.run(cmd, stderr=redirect)
 	if REDIRECT != Path():
 		redirect.close()
 
@@ -61,27 +83,24 @@ def concat_video(TEMP_DIR: Path, LOG_LEVEL: str, stage_id: str, slice_paths: Lis
 
 	# then do subprocess for concat list
 	concat_path = TEMP_DIR / f"concat-{stage_id}.mp4"
+	# the list names files relative to the temp dir, so FFmpeg runs from there. other stages may be
+	# concatenating at the same time, so the working directory of this process is left alone.
 	cmd = [
 		"ffmpeg", "-hide_banner", "-f", "concat",
-		"-safe", "0", "-i", str(list_path),
-		"-c", "copy", str(concat_path),
+		"-safe", "0", "-i", list_path.name,
+		"-c", "copy", concat_path.name,
 		"-y", "-stats", "-loglevel", LOG_LEVEL
 	]
 	
 	cprint(f"#rConcatenating videos for `#fM{stage_id}#r`")
-	
-	# we need to hop directories real fast to perform this function.
-	# we'll come back when we're done.
-	cwd = os.getcwd()
-	os.chdir(str(TEMP_DIR))
 
 	redirect = subprocess.DEVNULL
 	if REDIRECT != Path():
 		redirect = open(REDIRECT, "w")
-	result = subprocess.run(cmd, stderr=redirect, check=True)
+	with metrics.timer("ffmpeg_seconds", op="concat"):
+		result = subprocess.run(cmd, stderr=redirect, check=True, cwd=str(TEMP_DIR))
 	if REDIRECT != Path():
 		redirect.close()
-	os.chdir(cwd)
 
 	if result.returncode != 0:
 		raise FailedToConcat()
@@ -102,7 +121,12 @@ def process_stage(conf: Config, stage: StageData) -> Path:
 
 	# slice all the slices
 	slices = len(stage.slices)
-	slice_paths = [slice_video(tempdir, loglevel, stage.slices[x], conf.export.ffmpeg_stderr, x, slices) for x in range(slices)]
+
+	# edge case of one full length video, no ffmpeg needed
+	if slices == 1 and is_full_slice(stage.slices[0]):
+		return clone_video(tempdir, stage.id, stage.slices[0], 0, slices)
+
+	slice_paths = [slice_video(tempdir, loglevel, stage.id, stage.slices[x], conf.export.ffmpeg_stderr, x, slices) for x in range(slices)]
 
 	# edge case of one video
 	if len(slice_paths) == 1:
@@ -120,3 +144,103 @@ def process_stage(conf: Config, stage: StageData) -> Path:
 
 	# return the path of the concated vid
 	return concat_path
+
+
+class StageStream:
+	"""
+	Slices and concatenates a stage with a single FFmpeg process that writes fragmented MP4 to a
+	pipe. The output is spooled to a file in the temp directory, so it can be read back while it is
+	still being produced, and re-read if an upload chunk needs to be sent again.
+	"""
+
+	SPOOL_READ_SIZE = 1024 * 1024
+
+	def __init__(self, conf: Config, stage: StageData) -> None:
+		tempdir = Path(conf.directories.temp)
+		self.stage_id = stage.id
+		self.list_path = tempdir / f"stream-{stage.id}.txt"
+		self.spool_path = tempdir / f"stream-{stage.id}.mp4"
+		self.written = 0
+		self.done = False
+		self._cond = Condition()
+
+		# the concat demuxer can slice each file on its own with inpoint and outpoint
+		with open(str(self.list_path), "w") as f:
+			for vslice in stage.slices:
+				filepath = str(Path(vslice.filepath).resolve()).replace("'", "'\\''")
+				f.write(f"file '{filepath}'\n")
+				f.write(f"inpoint {timestring_as_seconds(vslice.ss)}\n")
+				if vslice.to != "EOF":
+					f.write(f"outpoint {timestring_as_seconds(vslice.to)}\n")
+
+		# fragmented mp4 never seeks back to rewrite a header, so it can go through a pipe
+		cmd = [
+			"ffmpeg", "-hide_banner", "-f", "concat",
+			"-safe", "0", "-i", str(self.list_path),
+			"-c", "copy", "-f", "mp4",
+			"-movflags", "frag_keyframe+empty_moov+default_base_moof",
+			"pipe:1", "-loglevel", conf.export.ffmpeg_loglevel
+		]
+
+		cprint(f"#rStreaming stage `#fM{stage.id}#r` #d({len(stage.slices)} part(s))#r")
+
+		redirect = subprocess.DEVNULL
+		if conf.export.ffmpeg_stderr != Path():
+			redirect = open(conf.export.ffmpeg_stderr, "w")
+		self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=redirect)
+		if conf.export.ffmpeg_stderr != Path():
+			redirect.close()
+
+		self._spool_file = open(str(self.spool_path), "wb")
+		self._thread = Thread(target=self._spool, daemon=True)
+		self._thread.start()
+
+	def _spool(self) -> None:
+		try:
+			while True:
+				chunk = self.process.stdout.read1(self.SPOOL_READ_SIZE)
+				if not chunk:
+					break
+				self._spool_file.write(chunk)
+				self._spool_file.flush()
+				with self._cond:
+					self.written += len(chunk)
+					self._cond.notify_all()
+		except BaseException:
+			# nothing drains the pipe anymore, FFmpeg would block on it forever
+			self.process.kill()
+			raise
+		finally:
+			self.process.wait()
+			try:
+				self._spool_file.close()
+			finally:
+				# readers wait on this, it has to be set however the spooling ended
+				with self._cond:
+					self.done = True
+					self._cond.notify_all()
+
+	def read(self, begin: int, length: int) -> bytes:
+		"""
+		Reads bytes from the stream, blocking until they are written or FFmpeg exits. A short read
+		means the stream has ended.
+		"""
+		with self._cond:
+			self._cond.wait_for(lambda: self.done or self.written >= begin + length)
+			if self.done and self.process.returncode != 0:
+				raise FailedToSlice(self.stage_id)
+
+		with open(str(self.spool_path), "rb") as f:
+			f.seek(begin)
+			return f.read(length)
+
+	def close(self) -> None:
+		if self.process.poll() is None:
+			self.process.kill()
+		self._thread.join()
+
+		try:
+			os.remove(str(self.list_path))
+			os.remove(str(self.spool_path))
+		except Exception as e:
+			raise FailedToCleanUp(e)
@@ -1,11 +1,18 @@
 # Module to ship webhooks out to various places, currently only Discord is supported
+# Webhooks are sent from a background thread so they never hold up pulling, exporting, or uploading.
 from typing import Dict, List, Union
 
 from vodbot.commands.stage import StageData
 from .twitch import Clip, Vod
 from .config import Config
+from .printer import cprint
 from .util import format_duration as formdur
 
+import atexit
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import sleep
+
 from discord_webhook import DiscordWebhook, DiscordEmbed
 
 _config_attributes = {
@@ -23,8 +30,26 @@ _config_attributes = {
 }
 _webhooks = {atrb: None for atrb in _config_attributes}
 
+# Bursts of these webhooks are merged into one message, Discord allows up to 10 embeds per message.
+_COALESCED_WEBHOOKS = ["pull_vod", "pull_clip"]
+_MAX_EMBEDS = 10
+# Seconds to wait for more of a burst before sending what has been gathered.
+_COALESCE_WINDOW = 2
+# Seconds to wait for queued webhooks to go out when exiting.
+_FLUSH_TIMEOUT = 30
+
+_EMBED_FOOTER = "VodBot \U0001F49C by NotQuiteApex & Friend Team Inc."
+_EMBED_COLOR = "7353b2"
+
+# Queue of (webhook name, embed) pairs waiting to be sent, ended by _STOP.
+_STOP = object()
+_queue = Queue(maxsize=1000)
+_dispatcher: Thread = None
+
 
 def init_webhooks(conf: Config):
+	global _dispatcher
+
 	# check main toggle
 	if not conf.webhooks.enable or not conf.webhooks.url:
 		return
@@ -43,43 +68,93 @@ def init_webhooks(conf: Config):
 			if getattr(confwh, what, None):
 				o[what] = getattr(confwh, what)
 
-		# setup webhook and embed
-		webhook = DiscordWebhook(
-			url=o["url"], content=o["message"], username=o["username"],
-			avatar_url=o["avatar_url"], rate_limit_retry=True)
-		embed = DiscordEmbed()
+		_webhooks[atrb] = o
+
+	if _dispatcher is None:
+		_dispatcher = Thread(target=_dispatch, name="webhook-dispatcher", daemon=True)
+		_dispatcher.start()
+		atexit.register(flush_webhooks)
 
-		embed.set_footer(text="VodBot \U0001F49C by NotQuiteApex & Friend Team Inc.")
-		embed.set_color("7353b2")
 
+def flush_webhooks(timeout: float=_FLUSH_TIMEOUT):
+	"""
+	Sends everything still queued and stops the dispatcher. Called automatically on exit.
+	"""
+	global _dispatcher
+
+	if _dispatcher is None:
+		return
+
+	_queue.put(_STOP)
+	_dispatcher.join(timeout)
+	_dispatcher = None
+
+
+def _execute(wh: str, embeds: List[DiscordEmbed]):
+	o = _webhooks[wh]
+	webhook = DiscordWebhook(
+		url=o["url"], content=o["message"], username=o["username"],
+		avatar_url=o["avatar_url"], rate_limit_retry=True)
+	for embed in embeds:
 		webhook.add_embed(embed)
 
-		_webhooks[atrb] = (webhook, embed)
+	try:
+		resp = webhook.execute()
+	except:
+		# ignore failures to connect
+		return
+
+	# wait out the rate limit here, rather than getting a 429 on the next message
+	try:
+		if resp.headers.get("x-ratelimit-remaining") == "0":
+			sleep(float(resp.headers.get("x-ratelimit-reset-after", 0)))
+	except (AttributeError, ValueError):
+		pass
+
+
+def _dispatch():
+	pending = None
+	while True:
+		item = pending if pending is not None else _queue.get()
+		pending = None
+		if item is _STOP:
+			return
+
+		wh, embed = item
+		embeds = [embed]
+
+		# gather up the rest of a burst of the same webhook, anything else is held for the next send
+		if wh in _COALESCED_WEBHOOKS:
+			while len(embeds) < _MAX_EMBEDS:
+				try:
+					nextitem = _queue.get(timeout=_COALESCE_WINDOW)
+				except Empty:
+					break
+				if nextitem is _STOP or nextitem[0] != wh:
+					pending = nextitem
+					break
+				embeds.append(nextitem[1])
+
+		_execute(wh, embeds)
 
 
 def _send_webhook(wh:str, **kwargs: Union[str, List[Dict[str, Union[str, bool]]]]):
 	# check if there is a webhook and it has a url, otherwise safely ignore
-	if _webhooks.get(wh, None) is None or not _webhooks[wh][0].url:
+	if _webhooks.get(wh, None) is None or not _webhooks[wh]["url"] or _dispatcher is None:
 		return
-	
-	webhook: DiscordWebhook
-	embed: DiscordEmbed
-	(webhook, embed) = _webhooks[wh]
 
-	embed.url = kwargs.get("url")
-	embed.title = kwargs.get("title", "UNKNOWN TITLE PLZ FIX")
-	embed.description = kwargs.get("description")
+	embed = DiscordEmbed(
+		url=kwargs.get("url"),
+		title=kwargs.get("title", "UNKNOWN TITLE PLZ FIX"),
+		description=kwargs.get("description"))
 	embed.fields = kwargs.get("fields", [])
-	embed.color = kwargs.get("color", embed.color)
-	
-	webhook.remove_embeds()
-	webhook.add_embed(embed)
-	# TODO: use async?
+	embed.set_color(kwargs.get("color", _EMBED_COLOR))
+	embed.set_footer(text=_EMBED_FOOTER)
+
 	try:
-		resp = webhook.execute(remove_embeds=True)
-	except:
-		# ignore failures to connect
-		pass
+		_queue.put_nowait((wh, embed))
+	except Full:
+		cprint(f"#fY#dWARN: Webhook queue is full, dropping `{_config_attributes[wh]}` webhook.#r")
 
 
 def send_pull_vod(vod: Vod):